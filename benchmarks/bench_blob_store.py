@@ -0,0 +1,102 @@
+"""
+基准：内容寻址缓存的去重率和重组开销。
+
+生成一个上游仓库和若干 fork（每个 fork 修改少量文件），全部写入 BlobStore，
+报告逻辑大小与实际存储大小，并比较从 blob 重组内容与读取整份内容文件
+（不去重的平铺缓存）的耗时。
+
+用法：
+    python -m benchmarks.bench_blob_store --files 2000 --file-size 4096 --forks 10
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from server.blob_store import BlobStore
+
+SEP = "=" * 48
+
+
+def render(files: dict) -> str:
+    blocks = [f"{SEP}\nFILE: {path}\n{SEP}\n{body}\n\n" for path, body in files.items()]
+    return "\n".join(blocks)
+
+
+def build_forks(files: int, file_size: int, forks: int, changed: int) -> list:
+    """返回 [上游, fork1, ...] 的 gitingest 风格内容。"""
+    rng = random.Random(0)
+    upstream = {
+        f"pkg{i % 50}/file{i}.txt": os.urandom(file_size // 2).hex() + "\n"
+        for i in range(files)
+    }
+    contents = [render(upstream)]
+    paths = list(upstream)
+    for _ in range(forks):
+        fork = dict(upstream)
+        for path in rng.sample(paths, changed):
+            fork[path] = os.urandom(file_size // 2).hex() + "\n"
+        contents.append(render(fork))
+    return contents
+
+
+def timed(fn, rounds: int) -> list:
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--file-size", type=int, default=4096)
+    parser.add_argument("--forks", type=int, default=10)
+    parser.add_argument("--changed", type=int, default=20, help="每个 fork 修改的文件数")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    contents = build_forks(args.files, args.file_size, args.forks, args.changed)
+
+    with tempfile.TemporaryDirectory(prefix="bench-blob-") as root:
+        store = BlobStore(root, max_bytes=1 << 40, ttl_seconds=0)
+        start = time.perf_counter()
+        for i, content in enumerate(contents):
+            store.put({"repo": f"fork{i}/repo"}, content, "")
+        put_seconds = time.perf_counter() - start
+
+        stats = store.stats()
+        print(f"repos: {len(contents)} x {args.files} files x {args.file_size} B, "
+              f"{args.changed} files changed per fork")
+        print(f"logical  {stats['logical_bytes'] / 1e6:>10.1f} MB")
+        print(f"stored   {stats['blob_bytes'] / 1e6:>10.1f} MB  "
+              f"({stats['blobs']} blobs, dedup x{stats['dedup_ratio']})")
+        print(f"put      {put_seconds / len(contents):>10.3f} s/repo")
+
+        manifest = store.get({"repo": "fork1/repo"})
+        assemble = timed(lambda: store.assemble(manifest), args.rounds)
+        # 基线：每个仓库整份内容存一个文件
+        flat_path = os.path.join(root, "flat.txt")
+        with open(flat_path, "w", encoding="utf-8") as f:
+            f.write(contents[1])
+
+        def read_flat():
+            with open(flat_path, encoding="utf-8") as f:
+                return f.read()
+
+        baseline = timed(read_flat, args.rounds)
+        assert store.assemble(manifest) == contents[1]
+
+        print(f"{'path':<10} {'median(s)':>10} {'min(s)':>10} {'max(s)':>10}")
+        for name, timings in (("assemble", assemble), ("flat", baseline)):
+            print(f"{name:<10} {statistics.median(timings):>10.4f} "
+                  f"{min(timings):>10.4f} {max(timings):>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
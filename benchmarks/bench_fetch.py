@@ -0,0 +1,119 @@
+"""
+基准：tarball 快照 vs 浅克隆 vs sparse 部分克隆。
+
+在临时目录生成一个测试仓库，本地启动 HTTP 服务提供 codeload 风格的 tar.gz，
+浅克隆通过 file:// 协议进行（与 gitingest 的 --depth 1 --single-branch 相同），
+sparse 只检出匹配 --patterns 的文件（默认每 20 个文件中有 1 个 .md）。
+
+用法：
+    python -m benchmarks.bench_fetch --files 2000 --file-size 4096 --rounds 5
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from server import fetch_governor
+from server.fetch_backends import GitCloneBackend, SnapshotBackend, SparseCloneBackend
+from server.fetch_governor import FetchGovernor
+
+
+def _git(args, cwd):
+    subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True)
+
+
+def build_repo(root: str, files: int, file_size: int, commits: int) -> str:
+    """生成带若干次提交历史的测试仓库（裸仓库在 root/git 下），返回 tarball 路径。"""
+    work = os.path.join(root, "work")
+    os.makedirs(work)
+    _git(["init", "-q", "-b", "main"], work)
+    for commit in range(commits):
+        for i in range(files):
+            directory = os.path.join(work, f"pkg{i % 50}")
+            os.makedirs(directory, exist_ok=True)
+            suffix = "md" if i % 20 == 0 else "txt"
+            with open(os.path.join(directory, f"file{i}.{suffix}"), "wb") as f:
+                f.write(os.urandom(file_size // 2).hex().encode())
+        _git(["add", "."], work)
+        _git(["-c", "user.name=bench", "-c", "user.email=bench@localhost",
+              "commit", "-qm", f"commit {commit}"], work)
+
+    bare = os.path.join(root, "git", "owner", "repo.git")
+    os.makedirs(os.path.dirname(bare))
+    _git(["clone", "-q", "--bare", work, bare], root)
+    _git(["config", "uploadpack.allowFilter", "true"], bare)
+
+    tarball = os.path.join(root, "archive.tar.gz")
+    _git(["archive", "--format=tar.gz", "--prefix=repo-main/", "-o", tarball, "main"], work)
+    return tarball
+
+
+def serve_archive(tarball: str) -> ThreadingHTTPServer:
+    with open(tarball, "rb") as f:
+        body = f.read()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def bench(backend, rounds: int, workdir: str, include_patterns=None) -> list:
+    timings = []
+    for i in range(rounds):
+        dest = os.path.join(workdir, f"{backend.name}-{i}")
+        start = time.perf_counter()
+        backend.fetch("owner/repo", "main", dest, include_patterns=include_patterns)
+        timings.append(time.perf_counter() - start)
+        shutil.rmtree(dest)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--file-size", type=int, default=4096)
+    parser.add_argument("--commits", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--patterns", default="*.md", help="sparse 模式的 include_patterns")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-fetch-") as root:
+        tarball = build_repo(root, args.files, args.file_size, args.commits)
+        httpd = serve_archive(tarball)
+        archive_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+        git_url = f"file://{os.path.join(root, 'git')}"
+        backends = [
+            (SnapshotBackend(archive_url), None),
+            (GitCloneBackend(git_url), None),
+            (SparseCloneBackend(git_url), args.patterns),
+        ]
+
+        print(f"repo: {args.files} files x {args.file_size} B, {args.commits} commits")
+        print(f"{'backend':<10} {'median(s)':>10} {'min(s)':>10} {'max(s)':>10}")
+        with patch.object(fetch_governor, "_governor", FetchGovernor(rate_per_second=0)):
+            for backend, patterns in backends:
+                timings = bench(backend, args.rounds, root, patterns)
+                print(f"{backend.name:<10} {statistics.median(timings):>10.3f} "
+                      f"{min(timings):>10.3f} {max(timings):>10.3f}")
+        httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+ingest 结果缓存：manifest + 内容寻址的共享 blob 存储。
+
+每条缓存是一个 manifest，按顺序记录文件标题和 blob 摘要；
+文件内容按 SHA-256 摘要只存一份，fork、镜像和相邻提交之间相同的文件
+共享同一个 blob。blob 按引用计数回收：manifest 被淘汰时
+减少引用，引用归零的 blob 被删除。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from server.content_format import format_header, iter_file_blocks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_CACHE_TTL_SECONDS = 3600
+
+
+def content_digest(data: bytes) -> str:
+    """
+    计算 blob 的 SHA-256 摘要。
+
+    blob 是 gitingest 输出的文件文本（已解码、末尾换行已统一），
+    与仓库中原始文件的 git blob SHA 不同。
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def _split_body(body: str) -> tuple[str, int]:
+    """
+    把文件块正文拆成 blob 文本和 gitingest 追加的换行数。
+
+    正文末尾的换行数取决于文件在目录中的位置，统一保留一个换行作为
+    文件内容，其余记录在 manifest 中，保证相同文件得到相同的 blob。
+    """
+    stripped = body.rstrip("\n")
+    newlines = len(body) - len(stripped)
+    if newlines == 0:
+        return body, 0
+    return stripped + "\n", newlines - 1
+
+
+def cache_key_id(key: Dict[str, Any]) -> str:
+    """把缓存键参数转换为稳定的 ID。"""
+    encoded = json.dumps(key, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class BlobStore:
+    """
+    基于目录的内容寻址缓存。
+
+    目录结构：
+        blobs/ab/cdef...     文件内容（UTF-8），文件名为内容摘要
+        manifests/<id>.json  缓存条目
+
+    引用计数和 LRU 顺序在启动时从 manifest 重建，不单独持久化。
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        ttl_seconds: float = DEFAULT_CACHE_TTL_SECONDS
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._blob_dir = os.path.join(root, "blobs")
+        self._manifest_dir = os.path.join(root, "manifests")
+        os.makedirs(self._blob_dir, exist_ok=True)
+        os.makedirs(self._manifest_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        # manifest id -> (引用的 blob 集合, 逻辑大小)，按最近使用排序
+        self._manifests: "OrderedDict[str, tuple[Set[str], int]]" = OrderedDict()
+        self._refcounts: Dict[str, int] = {}
+        self._blob_sizes: Dict[str, int] = {}
+        self._load()
+
+    def _blob_path(self, sha: str) -> str:
+        return os.path.join(self._blob_dir, sha[:2], sha[2:])
+
+    def _manifest_path(self, manifest_id: str) -> str:
+        return os.path.join(self._manifest_dir, f"{manifest_id}.json")
+
+    def _load(self):
+        """从磁盘重建索引，并清理没有被引用的 blob。"""
+        entries = []
+        for name in os.listdir(self._manifest_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self._manifest_dir, name)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    manifest = json.load(f)
+                entries.append((os.path.getmtime(path), manifest))
+            except (OSError, ValueError) as e:
+                logger.warning(f"跳过损坏的缓存条目 {path}: {e}")
+
+        for _, manifest in sorted(entries, key=lambda item: item[0]):
+            self._track(manifest)
+
+        for prefix in os.listdir(self._blob_dir):
+            prefix_dir = os.path.join(self._blob_dir, prefix)
+            for rest in os.listdir(prefix_dir):
+                sha = prefix + rest
+                if sha not in self._refcounts:
+                    os.remove(os.path.join(prefix_dir, rest))
+
+    def _track(self, manifest: Dict[str, Any]):
+        shas = {entry[1] for entry in manifest["entries"]}
+        for sha in shas:
+            self._refcounts[sha] = self._refcounts.get(sha, 0) + 1
+            if sha not in self._blob_sizes:
+                try:
+                    self._blob_sizes[sha] = os.path.getsize(self._blob_path(sha))
+                except OSError:
+                    self._blob_sizes[sha] = 0
+        self._manifests[manifest["id"]] = (shas, manifest["size"])
+
+    def _release(self, manifest_id: str) -> List[str]:
+        """减少 manifest 引用的 blob 计数，返回引用归零的 blob。"""
+        shas, _ = self._manifests.pop(manifest_id)
+        unreferenced = []
+        for sha in shas:
+            self._refcounts[sha] -= 1
+            if self._refcounts[sha] == 0:
+                del self._refcounts[sha]
+                unreferenced.append(sha)
+        return unreferenced
+
+    def _remove_blobs(self, shas: List[str]):
+        for sha in shas:
+            # 可能已被新的 manifest 重新引用
+            if sha in self._refcounts:
+                continue
+            self._blob_sizes.pop(sha, None)
+            try:
+                os.remove(self._blob_path(sha))
+            except FileNotFoundError:
+                pass
+
+    def _untrack(self, manifest_id: str):
+        self._remove_blobs(self._release(manifest_id))
+        try:
+            os.remove(self._manifest_path(manifest_id))
+        except FileNotFoundError:
+            pass
+
+    def _write_blob(self, data: bytes) -> str:
+        sha = content_digest(data)
+        if sha not in self._blob_sizes:
+            path = self._blob_path(sha)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_atomic(path, data)
+            self._blob_sizes[sha] = len(data)
+        return sha
+
+    def put(
+        self,
+        key: Dict[str, Any],
+        content: str,
+        summary: str,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        保存一次 ingest 的结果。
+
+        Args:
+            key: 缓存键参数（仓库、ref、模式等）
+            content: gitingest 输出的内容，按文件切分
+            summary: 摘要
+            metadata: 可选，需要一起缓存的其他字段
+
+        Returns:
+            写入的 manifest
+        """
+        manifest_id = cache_key_id(key)
+        with self._lock:
+            entries: List[list] = []
+            preamble = ""
+            # 不去重时的存储量（UTF-8 字节）
+            size = 0
+            for block in iter_file_blocks([content]):
+                if block.header is None:
+                    preamble = block.body
+                    size += len(preamble.encode("utf-8"))
+                    continue
+                blob, newlines = _split_body(block.body)
+                data = blob.encode("utf-8")
+                size += len(format_header(block.header).encode("utf-8")) + len(data) + newlines
+                entries.append([block.header, self._write_blob(data), newlines])
+
+            manifest = {
+                "id": manifest_id,
+                "key": key,
+                "created": time.time(),
+                "summary": summary,
+                "metadata": metadata or {},
+                "preamble": preamble,
+                "entries": entries,
+                "size": size,
+            }
+            # 覆盖同一个键：先登记新 manifest，再回收旧 manifest 独占的 blob
+            replaced = self._release(manifest_id) if manifest_id in self._manifests else []
+            _write_atomic(
+                self._manifest_path(manifest_id),
+                json.dumps(manifest, ensure_ascii=False).encode("utf-8"),
+            )
+            self._track(manifest)
+            self._remove_blobs(replaced)
+            self._evict(keep=manifest_id)
+        return manifest
+
+    def get(self, key: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        查找缓存条目，过期的条目会被删除。
+
+        Returns:
+            manifest，未命中时返回 None
+        """
+        manifest_id = cache_key_id(key)
+        with self._lock:
+            if manifest_id not in self._manifests:
+                return None
+            try:
+                with open(self._manifest_path(manifest_id), encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                self._untrack(manifest_id)
+                return None
+            if self.ttl_seconds > 0 and time.time() - manifest["created"] > self.ttl_seconds:
+                self._untrack(manifest_id)
+                return None
+            self._manifests.move_to_end(manifest_id)
+            # 更新 mtime，重启后保持 LRU 顺序
+            os.utime(self._manifest_path(manifest_id))
+            return manifest
+
+    def iter_content(self, manifest: Dict[str, Any]) -> Iterator[str]:
+        """
+        按文件流式重组内容。
+
+        Raises:
+            OSError: 如果 blob 在读取期间被淘汰
+        """
+        if manifest["preamble"]:
+            yield manifest["preamble"]
+        for header, sha, newlines in manifest["entries"]:
+            with open(self._blob_path(sha), "rb") as f:
+                blob = f.read().decode("utf-8")
+            yield format_header(header)
+            yield blob
+            if newlines:
+                yield "\n" * newlines
+
+    def assemble(self, manifest: Dict[str, Any]) -> str:
+        """重组完整内容。"""
+        return "".join(self.iter_content(manifest))
+
+    def _evict(self, keep: Optional[str] = None):
+        """按 LRU 淘汰 manifest，直到 blob 总大小不超过容量。"""
+        while self.blob_bytes > self.max_bytes:
+            victim = next((mid for mid in self._manifests if mid != keep), None)
+            if victim is None:
+                break
+            logger.info(f"缓存超过容量，淘汰 {victim}")
+            self._untrack(victim)
+
+    @property
+    def blob_bytes(self) -> int:
+        return sum(self._blob_sizes.values())
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        返回缓存统计。logical_bytes 为不去重时所需的存储量。
+        """
+        with self._lock:
+            logical = sum(size for _, size in self._manifests.values())
+            stored = self.blob_bytes
+            return {
+                "manifests": len(self._manifests),
+                "blobs": len(self._blob_sizes),
+                "blob_bytes": stored,
+                "logical_bytes": logical,
+                "dedup_ratio": round(logical / stored, 2) if stored else None,
+            }
+
+
+_cache: Optional[BlobStore] = None
+_cache_lock = threading.Lock()
+
+
+def get_ingest_cache() -> Optional[BlobStore]:
+    """
+    获取进程级共享的 ingest 缓存。
+
+    未设置环境变量 INGEST_CACHE_DIR 时不启用缓存，返回 None。
+    """
+    global _cache
+    root = os.getenv("INGEST_CACHE_DIR")
+    if not root:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.root != root:
+            _cache = BlobStore(
+                root,
+                max_bytes=int(os.getenv("INGEST_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)),
+                ttl_seconds=float(
+                    os.getenv("INGEST_CACHE_TTL_SECONDS", DEFAULT_CACHE_TTL_SECONDS)
+                ),
+            )
+        return _cache
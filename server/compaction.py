@@ -0,0 +1,213 @@
+"""
+精简输出：在返回内容前按文件流式压缩，减少 token 占用。
+
+- 完全相同的文件只保留第一份，之后的替换为引用
+- 多个文件重复出现的许可证 / 样板头注释只保留第一份
+- 去掉行尾空白，连续空行压缩到上限
+- 锁文件、生成代码和压缩过的资源文件只保留开头一段
+"""
+
+import fnmatch
+import hashlib
+import posixpath
+import re
+from typing import Any, Dict, Iterable, Iterator
+
+from server.content_format import (
+    FileBlock,
+    format_header,
+    iter_file_blocks,
+    render_blocks,
+)
+
+# 连续空行的上限
+DEFAULT_MAX_BLANK_LINES = 2
+# 生成文件保留的字符数
+DEFAULT_TRUNCATE_CHARS = 1000
+# 头注释至少有这么多行才视为许可证 / 样板
+DEFAULT_HEADER_MIN_LINES = 3
+
+# 按文件名识别的生成文件
+GENERATED_FILE_PATTERNS = (
+    "package-lock.json",
+    "npm-shrinkwrap.json",
+    "yarn.lock",
+    "pnpm-lock.yaml",
+    "poetry.lock",
+    "Pipfile.lock",
+    "uv.lock",
+    "Cargo.lock",
+    "Gemfile.lock",
+    "composer.lock",
+    "go.sum",
+    "*.min.js",
+    "*.min.css",
+    "*.map",
+    "*_pb2.py",
+    "*.pb.go",
+)
+# 文件开头的注释行中出现这些标记时视为生成代码；文档正文中的同样字样不算
+_GENERATED_MARKER = re.compile(
+    r"^\s*(?:#|//|/\*|\*|--|;|<!--)"
+    r".*(?:@generated|DO NOT EDIT|Code generated|auto-?generated)",
+    re.IGNORECASE | re.MULTILINE
+)
+_GENERATED_MARKER_LINES = 5
+# 文档文件不按生成标记截断
+PROSE_EXTENSIONS = (".md", ".markdown", ".rst", ".txt", ".adoc")
+# 资源 / 数据文件中平均行长超过该值的较大文件视为压缩过的资源；
+# 文档等不换行的正文不适用
+MINIFIED_EXTENSIONS = (".js", ".mjs", ".css", ".json", ".svg", ".map")
+_MINIFIED_MIN_CHARS = 2000
+_MINIFIED_AVG_LINE_LENGTH = 300
+
+_LINE_COMMENT = re.compile(r"\s*(#|//|--|;)")
+_BLOCK_COMMENTS = (("/*", "*/"), ("<!--", "-->"))
+_TRAILING_WHITESPACE = re.compile(r"[ \t\r]+$", re.MULTILINE)
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _leading_comment(lines: list) -> tuple[int, int]:
+    """
+    找出文件开头的注释块，跳过 shebang。
+
+    Returns:
+        注释块在 lines 中的 (start, end)，没有时 start == end
+    """
+    start = 1 if lines and lines[0].startswith("#!") else 0
+    if start >= len(lines):
+        return start, start
+    first = lines[start].lstrip()
+    for opener, closer in _BLOCK_COMMENTS:
+        if first.startswith(opener):
+            for end in range(start, len(lines)):
+                if closer in lines[end]:
+                    return start, end + 1
+            return start, start
+    end = start
+    while end < len(lines) and _LINE_COMMENT.match(lines[end]):
+        end += 1
+    return start, end
+
+
+class ContentCompactor:
+    """
+    流式压缩 gitingest 内容，逐个文件处理，只保存已见文件和头注释的摘要。
+
+    同一个实例在一次请求内使用，统计结果通过 to_dict() 读取。
+    """
+
+    def __init__(
+        self,
+        max_blank_lines: int = DEFAULT_MAX_BLANK_LINES,
+        truncate_chars: int = DEFAULT_TRUNCATE_CHARS,
+        header_min_lines: int = DEFAULT_HEADER_MIN_LINES
+    ):
+        self.max_blank_lines = max_blank_lines
+        self.truncate_chars = truncate_chars
+        self.header_min_lines = header_min_lines
+        self._blank_run = re.compile(r"\n{%d,}" % (max_blank_lines + 2))
+        self.reset()
+
+    def reset(self):
+        """清空已见文件和统计，README 降级重新 ingest 时使用。"""
+        self._seen_files: Dict[str, str] = {}
+        self._seen_headers: Dict[str, str] = {}
+        self.files = 0
+        self.duplicates = 0
+        self.headers_stripped = 0
+        self.truncated = 0
+        self.chars_before = 0
+        self.chars_after = 0
+
+    @property
+    def chars_saved(self) -> int:
+        return self.chars_before - self.chars_after
+
+    def _is_generated(self, path: str, text: str) -> bool:
+        name = posixpath.basename(path)
+        if any(fnmatch.fnmatch(name, pattern) for pattern in GENERATED_FILE_PATTERNS):
+            return True
+        head = "\n".join(text.split("\n", _GENERATED_MARKER_LINES)[:_GENERATED_MARKER_LINES])
+        if not name.lower().endswith(PROSE_EXTENSIONS) and _GENERATED_MARKER.search(head):
+            return True
+        return (
+            name.lower().endswith(MINIFIED_EXTENSIONS)
+            and len(text) >= _MINIFIED_MIN_CHARS
+            and len(text) / (text.count("\n") + 1) > _MINIFIED_AVG_LINE_LENGTH
+        )
+
+    def _truncate(self, text: str) -> str:
+        if len(text) <= self.truncate_chars:
+            return text
+        # 尽量在行尾截断
+        cut = text.rfind("\n", 0, self.truncate_chars)
+        cut = cut + 1 if cut > 0 else self.truncate_chars
+        self.truncated += 1
+        return f"{text[:cut]}\n[truncated generated file: {len(text) - cut} more chars]\n"
+
+    def _strip_header(self, path: str, text: str) -> str:
+        lines = text.split("\n")
+        start, end = _leading_comment(lines)
+        if end - start < self.header_min_lines:
+            return text
+        key = _digest("\n".join(line.rstrip() for line in lines[start:end]))
+        first = self._seen_headers.setdefault(key, path)
+        if first == path:
+            return text
+        self.headers_stripped += 1
+        marker = f"[header omitted: same as {first}]"
+        return "\n".join(lines[:start] + [marker] + lines[end:])
+
+    def _trim_whitespace(self, text: str) -> str:
+        text = _TRAILING_WHITESPACE.sub("", text)
+        return self._blank_run.sub("\n" * (self.max_blank_lines + 1), text)
+
+    def compact_block(self, block: FileBlock) -> FileBlock:
+        """压缩单个文件块。开头没有标题的部分原样保留。"""
+        header_chars = len(format_header(block.header)) if block.header is not None else 0
+        self.chars_before += header_chars + len(block.body)
+        if block.header is None or not block.body.strip():
+            self.chars_after += header_chars + len(block.body)
+            return block
+
+        self.files += 1
+        path = block.path
+        # 末尾的换行属于 gitingest 的块分隔，保持不变
+        text = block.body.rstrip("\n")
+        tail = block.body[len(text):]
+
+        first = self._seen_files.setdefault(_digest(text), path)
+        marker = f"[duplicate of {first}]"
+        if first != path and len(marker) < len(text):
+            self.duplicates += 1
+            text = marker
+        elif self._is_generated(path, text):
+            text = self._truncate(text)
+        else:
+            text = self._trim_whitespace(self._strip_header(path, text))
+
+        body = text + tail
+        self.chars_after += header_chars + len(body)
+        return FileBlock(block.header, body)
+
+    def compact_blocks(self, blocks: Iterable[FileBlock]) -> Iterator[FileBlock]:
+        for block in blocks:
+            yield self.compact_block(block)
+
+    def compact(self, content: str) -> str:
+        """逐个文件压缩完整内容。"""
+        return "".join(render_blocks(self.compact_blocks(iter_file_blocks([content]))))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "files": self.files,
+            "duplicates": self.duplicates,
+            "headers_stripped": self.headers_stripped,
+            "truncated": self.truncated,
+            "chars_before": self.chars_before,
+            "chars_after": self.chars_after,
+        }
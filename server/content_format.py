@@ -0,0 +1,101 @@
+"""gitingest 输出内容的流式解析：按文件切分和重新拼接。"""
+
+import re
+from collections import deque
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+# 与 gitingest 的文件分隔符一致
+SEPARATOR = "=" * 48
+_SEPARATOR_LINE = SEPARATOR + "\n"
+_HEADER_PATTERN = re.compile(r"(FILE|SYMLINK): .+")
+
+
+class FileBlock(NamedTuple):
+    """
+    内容中的一个文件块。
+
+    header 为 "FILE: path" 这样的标题行（不含换行），开头没有标题的部分为 None；
+    body 为标题之后、下一个文件之前的全部文本（含 gitingest 追加的空行）。
+    """
+    header: Optional[str]
+    body: str
+
+    @property
+    def path(self) -> Optional[str]:
+        if self.header is None:
+            return None
+        path = self.header.split(": ", 1)[1]
+        # SYMLINK: a -> b
+        return path.split(" -> ", 1)[0] if self.header.startswith("SYMLINK") else path
+
+
+def iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """把任意切分的文本块重新切成行（保留换行符）。"""
+    pending: list = []
+    for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find("\n", start)
+            if end < 0:
+                break
+            pending.append(chunk[start:end + 1])
+            yield "".join(pending)
+            pending = []
+            start = end + 1
+        # 不完整的行留到下一块
+        if start < len(chunk):
+            pending.append(chunk[start:])
+    if pending:
+        yield "".join(pending)
+
+
+def iter_file_blocks(chunks: Iterable[str]) -> Iterator[FileBlock]:
+    """
+    流式地把 gitingest 内容切分为文件块，内存中只保留当前文件。
+
+    "".join(render_blocks(iter_file_blocks(chunks))) 与原始内容完全一致。
+    """
+    lines = iter_lines(chunks)
+    window: deque = deque()
+    header: Optional[str] = None
+    body: list = []
+
+    def fill():
+        while len(window) < 3:
+            line = next(lines, None)
+            if line is None:
+                return
+            window.append(line)
+
+    fill()
+    while window:
+        if (
+            len(window) == 3
+            and window[0] == _SEPARATOR_LINE
+            and window[2] == _SEPARATOR_LINE
+            and _HEADER_PATTERN.fullmatch(window[1].rstrip("\n"))
+        ):
+            if header is not None or body:
+                yield FileBlock(header, "".join(body))
+            header = window[1].rstrip("\n")
+            body = []
+            window.clear()
+        else:
+            body.append(window.popleft())
+        fill()
+
+    if header is not None or body:
+        yield FileBlock(header, "".join(body))
+
+
+def format_header(header: str) -> str:
+    """渲染文件块的标题部分。"""
+    return f"{_SEPARATOR_LINE}{header}\n{_SEPARATOR_LINE}"
+
+
+def render_blocks(blocks: Iterable[FileBlock]) -> Iterator[str]:
+    """把文件块重新渲染为文本块。"""
+    for block in blocks:
+        if block.header is not None:
+            yield format_header(block.header)
+        yield block.body
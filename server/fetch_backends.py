@@ -0,0 +1,450 @@
+"""仓库抓取后端：gitingest 自带克隆之外的本地物化方式。"""
+
+import base64
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional
+from urllib.parse import quote, urlparse
+
+from server.fetch_governor import FetchTiming, get_fetch_governor
+
+logger = logging.getLogger(__name__)
+
+# 抓取模式
+FETCH_MODE_CLONE = "clone"        # 由 gitingest 自行浅克隆（默认）
+FETCH_MODE_SNAPSHOT = "snapshot"  # 下载 tarball 快照并流式解压
+FETCH_MODE_SPARSE = "sparse"      # blobless 部分克隆 + sparse-checkout，只下载匹配的文件
+FETCH_MODE_AUTO = "auto"          # 按请求范围和仓库大小自动选择
+FETCH_MODES = (FETCH_MODE_CLONE, FETCH_MODE_SNAPSHOT, FETCH_MODE_SPARSE, FETCH_MODE_AUTO)
+
+# 上游地址，可指向本地替身服务用于测试和基准
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_ARCHIVE_URL = os.getenv("GITHUB_ARCHIVE_URL", "https://codeload.github.com")
+GITHUB_GIT_URL = os.getenv("GITHUB_GIT_URL", "https://github.com")
+
+# 解析提交 SHA（缓存键）的超时，超时后跳过缓存
+COMMIT_LOOKUP_TIMEOUT = 5
+
+# auto 模式下，仓库大小（KB，GitHub API 的 size 字段）不小于该值时使用快照
+SNAPSHOT_AUTO_MIN_KB = int(os.getenv("SNAPSHOT_AUTO_MIN_KB", 20 * 1024))
+
+_STREAM_CHUNK_SIZE = 1024 * 1024
+# 完整的提交 SHA；git clone --branch 不接受，需要按 SHA fetch
+_COMMIT_SHA_PATTERN = re.compile(r"[0-9a-f]{40}")
+
+
+def _host_of(url: str) -> str:
+    return urlparse(url).hostname or "localhost"
+
+
+def _auth_headers(token: Optional[str]) -> Dict[str, str]:
+    return {"Authorization": f"token {token}"} if token else {}
+
+
+class FetchBackend(ABC):
+    """
+    抓取后端基类：把仓库的某个 ref 物化到本地目录。
+    """
+
+    name = ""
+
+    @abstractmethod
+    def fetch(
+        self,
+        repo_path: str,
+        ref: Optional[str],
+        dest_dir: str,
+        token: Optional[str] = None,
+        subdirectory: Optional[str] = None,
+        include_patterns: Optional[str] = None,
+        timeout: int = 120,
+        timing: Optional[FetchTiming] = None
+    ) -> str:
+        """
+        物化仓库内容。
+
+        Args:
+            repo_path: owner/repo
+            ref: 分支、tag 或 commit；None 表示默认分支
+            dest_dir: 目标目录（必须为空或不存在）
+            token: 可选的 GitHub token
+            subdirectory: 可选，只需要的子目录
+            include_patterns: 可选，只需要的文件模式（逗号分隔），后端可以忽略
+            timeout: 超时时间（秒）
+            timing: 可选，用于收集抓取统计
+
+        Returns:
+            仓库根目录的本地路径
+        """
+
+
+def _safe_member_path(name: str) -> Optional[str]:
+    """
+    去掉 tarball 的顶层目录（owner-repo-sha/），并拒绝越界路径。
+    """
+    parts = name.split("/", 1)
+    if len(parts) < 2 or not parts[1]:
+        return None
+    relative = os.path.normpath(parts[1])
+    if os.path.isabs(relative) or relative == ".." or relative.startswith("../"):
+        raise ValueError(f"Unsafe path in archive: {name}")
+    return relative
+
+
+class SnapshotBackend(FetchBackend):
+    """
+    通过 codeload 下载 tar.gz 快照，边下载边解压。
+
+    不需要 git 历史和 .git 目录，指定子目录时只解压该子目录下的文件。
+    """
+
+    name = FETCH_MODE_SNAPSHOT
+
+    def __init__(self, archive_url: Optional[str] = None):
+        self.archive_url = (archive_url or GITHUB_ARCHIVE_URL).rstrip("/")
+
+    def archive_url_for(self, repo_path: str, ref: Optional[str]) -> str:
+        return f"{self.archive_url}/{repo_path}/tar.gz/{ref or 'HEAD'}"
+
+    def fetch(
+        self,
+        repo_path: str,
+        ref: Optional[str],
+        dest_dir: str,
+        token: Optional[str] = None,
+        subdirectory: Optional[str] = None,
+        include_patterns: Optional[str] = None,
+        timeout: int = 120,
+        timing: Optional[FetchTiming] = None
+    ) -> str:
+        url = self.archive_url_for(repo_path, ref)
+        prefix = subdirectory.strip("/") + "/" if subdirectory else None
+
+        def download() -> int:
+            # 重试时从空目录重新开始
+            shutil.rmtree(dest_dir, ignore_errors=True)
+            os.makedirs(dest_dir, exist_ok=True)
+            request = urllib.request.Request(url, headers=_auth_headers(token))
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return _extract_stream(response, dest_dir, prefix)
+
+        count = get_fetch_governor().call(_host_of(url), token, download, timing=timing)
+        logger.info(f"快照 {url} 解压了 {count} 个文件")
+        return dest_dir
+
+
+def _extract_stream(fileobj, dest_dir: str, prefix: Optional[str]) -> int:
+    """
+    以流模式解压 tar.gz，只写出普通文件，返回写出的文件数。
+    """
+    count = 0
+    with tarfile.open(fileobj=fileobj, mode="r|gz") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            relative = _safe_member_path(member.name)
+            if relative is None:
+                continue
+            if prefix and not relative.startswith(prefix):
+                continue
+
+            target = os.path.join(dest_dir, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            source = archive.extractfile(member)
+            with open(target, "wb") as out:
+                shutil.copyfileobj(source, out, _STREAM_CHUNK_SIZE)
+            count += 1
+    return count
+
+
+def _git_auth_args(token: Optional[str]) -> List[str]:
+    """通过 extraHeader 传递 token，避免写入 URL 和 .git/config。"""
+    if not token:
+        return []
+    basic = base64.b64encode(f"x-access-token:{token}".encode()).decode()
+    return ["-c", f"http.extraHeader=Authorization: Basic {basic}"]
+
+
+def _run_git(args: List[str], timeout: int, cwd: Optional[str] = None) -> str:
+    try:
+        completed = subprocess.run(
+            ["git", *args],
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"git {args[0]} timed out after {timeout} seconds")
+    if completed.returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {completed.stderr.strip()}")
+    return completed.stdout
+
+
+class GitCloneBackend(FetchBackend):
+    """
+    普通浅克隆（--depth 1 --single-branch），与 gitingest 自带的克隆方式一致。
+    """
+
+    name = "git"
+
+    def __init__(self, git_url: Optional[str] = None):
+        self.git_url = (git_url or GITHUB_GIT_URL).rstrip("/")
+
+    def clone_url_for(self, repo_path: str) -> str:
+        return f"{self.git_url}/{repo_path}.git"
+
+    def _download(
+        self,
+        url: str,
+        ref: Optional[str],
+        dest_dir: str,
+        auth: List[str],
+        timeout: int,
+        extra_args: Optional[List[str]] = None
+    ) -> List[str]:
+        """
+        只下载 ref 指向的提交，不检出工作区。
+
+        分支和标签使用 clone --branch；提交 SHA 先 init 再按 SHA fetch
+        （GitHub 允许抓取可达的提交）。
+
+        Returns:
+            检出时传给 git checkout 的参数
+        """
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        extra_args = extra_args or []
+        if ref and _COMMIT_SHA_PATTERN.fullmatch(ref):
+            _run_git(["init", "--quiet", dest_dir], timeout)
+            # 部分克隆检出时要从 origin 按需拉取 blob
+            _run_git(["remote", "add", "origin", url], timeout, cwd=dest_dir)
+            _run_git([*auth, "fetch", "--quiet", "--depth", "1", *extra_args, "origin", ref],
+                     timeout, cwd=dest_dir)
+            return ["FETCH_HEAD"]
+        args = ["--depth", "1", "--single-branch", "--no-checkout", *extra_args]
+        if ref:
+            args += ["--branch", ref]
+        _run_git([*auth, "clone", "--quiet", *args, url, dest_dir], timeout)
+        return []
+
+    def fetch(
+        self,
+        repo_path: str,
+        ref: Optional[str],
+        dest_dir: str,
+        token: Optional[str] = None,
+        subdirectory: Optional[str] = None,
+        include_patterns: Optional[str] = None,
+        timeout: int = 120,
+        timing: Optional[FetchTiming] = None
+    ) -> str:
+        url = self.clone_url_for(repo_path)
+        auth = _git_auth_args(token)
+
+        def clone():
+            checkout = self._download(url, ref, dest_dir, auth, timeout)
+            _run_git([*auth, "checkout", "--quiet", *checkout], timeout, cwd=dest_dir)
+
+        get_fetch_governor().call(_host_of(url), token, clone, timing=timing)
+        return dest_dir
+
+
+def sparse_checkout_patterns(
+    include_patterns: Optional[str],
+    subdirectory: Optional[str]
+) -> tuple[bool, List[str]]:
+    """
+    把 include_patterns 和子目录翻译成 sparse-checkout 规则。
+
+    只有子目录时使用 cone 模式（按目录匹配，效率最高）；
+    有文件模式时使用 non-cone 模式（gitignore 语法），模式限定在子目录下。
+
+    Returns:
+        (cone, patterns)；patterns 为空表示不需要 sparse-checkout
+    """
+    subdir = subdirectory.strip("/") if subdirectory else ""
+    patterns = [p.strip() for p in (include_patterns or "").split(",") if p.strip()]
+
+    if not patterns:
+        return True, [subdir] if subdir else []
+    if not subdir:
+        return False, patterns
+
+    scoped = []
+    for pattern in patterns:
+        if "/" in pattern.rstrip("/"):
+            # 含路径的模式相对于仓库根锚定
+            scoped.append(f"/{subdir}/{pattern.lstrip('/')}")
+        else:
+            # 纯文件名模式匹配子目录下任意层级
+            scoped.append(f"/{subdir}/**/{pattern}")
+    return False, scoped
+
+
+class SparseCloneBackend(GitCloneBackend):
+    """
+    blobless 部分克隆（--filter=blob:none）+ sparse-checkout。
+
+    克隆时只下载 commit 和 tree，checkout 时按需拉取匹配 include_patterns /
+    子目录的 blob，文档或子目录分析不再需要下载整个工作区。
+    服务端不支持过滤时 git 会自动退回完整浅克隆。
+    """
+
+    name = FETCH_MODE_SPARSE
+
+    def fetch(
+        self,
+        repo_path: str,
+        ref: Optional[str],
+        dest_dir: str,
+        token: Optional[str] = None,
+        subdirectory: Optional[str] = None,
+        include_patterns: Optional[str] = None,
+        timeout: int = 120,
+        timing: Optional[FetchTiming] = None
+    ) -> str:
+        url = self.clone_url_for(repo_path)
+        cone, patterns = sparse_checkout_patterns(include_patterns, subdirectory)
+        auth = _git_auth_args(token)
+
+        def clone():
+            checkout = self._download(
+                url, ref, dest_dir, auth, timeout, extra_args=["--filter=blob:none"]
+            )
+            if patterns:
+                mode = "--cone" if cone else "--no-cone"
+                _run_git([*auth, "sparse-checkout", "set", mode, "--", *patterns],
+                         timeout, cwd=dest_dir)
+            # checkout 时才按 sparse 规则拉取需要的 blob
+            _run_git([*auth, "checkout", "--quiet", *checkout], timeout, cwd=dest_dir)
+
+        get_fetch_governor().call(_host_of(url), token, clone, timing=timing)
+        logger.info(f"sparse 克隆 {repo_path}，规则: {patterns or '全部'}")
+        return dest_dir
+
+
+# 可插拔的本地物化后端；FETCH_MODE_CLONE 由 gitingest 自行处理，不在此注册
+FETCH_BACKENDS: Dict[str, Callable[[], FetchBackend]] = {
+    FETCH_MODE_SNAPSHOT: SnapshotBackend,
+    FETCH_MODE_SPARSE: SparseCloneBackend,
+}
+
+
+def get_fetch_backend(mode: str) -> Optional[FetchBackend]:
+    """
+    获取抓取后端。
+
+    Returns:
+        FetchBackend 实例；FETCH_MODE_CLONE 返回 None，表示交给 gitingest
+    """
+    if mode == FETCH_MODE_CLONE:
+        return None
+    if mode not in FETCH_BACKENDS:
+        raise ValueError(f"Unknown fetch mode: {mode}")
+    return FETCH_BACKENDS[mode]()
+
+
+def get_repo_size_kb(
+    repo_path: str,
+    token: Optional[str] = None,
+    timeout: int = 10,
+    timing: Optional[FetchTiming] = None
+) -> int:
+    """
+    通过 GitHub API 查询仓库大小（KB）。
+    """
+    url = f"{GITHUB_API_URL.rstrip('/')}/repos/{repo_path}"
+
+    def lookup() -> int:
+        headers = {"Accept": "application/vnd.github+json", **_auth_headers(token)}
+        request = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return int(json.load(response)["size"])
+
+    return get_fetch_governor().call(_host_of(url), token, lookup, timing=timing)
+
+
+def resolve_commit_sha(
+    repo_path: str,
+    ref: Optional[str] = None,
+    token: Optional[str] = None,
+    timeout: float = COMMIT_LOOKUP_TIMEOUT,
+    timing: Optional[FetchTiming] = None
+) -> str:
+    """
+    通过 GitHub API 把分支或标签解析为提交 SHA，ref 为 None 时解析默认分支。
+
+    只用于缓存键，失败时调用方跳过缓存即可：遵守并发槽位，但只尝试一次，
+    不重试、不等待超过 timeout 的限流退避。
+    """
+    url = f"{GITHUB_API_URL.rstrip('/')}/repos/{repo_path}/commits/{quote(ref or 'HEAD', safe='')}"
+    deadline = time.monotonic() + timeout
+    if timing is not None and timing.deadline is not None:
+        deadline = min(deadline, timing.deadline)
+
+    headers = {"Accept": "application/vnd.github.sha", **_auth_headers(token)}
+    request = urllib.request.Request(url, headers=headers)
+    with get_fetch_governor().slot(_host_of(url), token, deadline) as waited:
+        if timing is not None:
+            timing.wait_seconds += waited
+            timing.attempts += 1
+        remaining = max(0.1, deadline - time.monotonic())
+        with urllib.request.urlopen(request, timeout=remaining) as response:
+            return response.read().decode("ascii").strip()
+
+
+def resolve_fetch_mode(
+    fetch_mode: Optional[str],
+    repo_path: str,
+    token: Optional[str] = None,
+    timing: Optional[FetchTiming] = None,
+    include_patterns: Optional[str] = None,
+    subdirectory: Optional[str] = None
+) -> str:
+    """
+    解析抓取模式。
+
+    auto 时：只需要部分文件（有 include_patterns 或子目录）的请求使用 sparse；
+    否则按仓库大小在 snapshot 和 clone 之间选择。
+
+    Args:
+        fetch_mode: clone / snapshot / sparse / auto；None 时读取环境变量 FETCH_MODE
+        repo_path: owner/repo
+        token: 可选的 GitHub token
+        timing: 可选，用于收集抓取统计
+        include_patterns: 可选的文件包含模式，None 表示全部文件
+        subdirectory: 可选的子目录
+
+    Returns:
+        实际使用的模式（clone 或已注册的后端名）
+
+    Raises:
+        ValueError: 如果模式未知
+    """
+    mode = fetch_mode or os.getenv("FETCH_MODE") or FETCH_MODE_CLONE
+    if mode != FETCH_MODE_AUTO:
+        if mode != FETCH_MODE_CLONE and mode not in FETCH_BACKENDS:
+            raise ValueError(f"Unknown fetch mode: {mode}")
+        return mode
+
+    if include_patterns or subdirectory:
+        logger.info("只需要部分文件，auto 选择 sparse 模式")
+        return FETCH_MODE_SPARSE
+
+    try:
+        size_kb = get_repo_size_kb(repo_path, token, timing=timing)
+    except Exception as e:
+        logger.warning(f"查询仓库大小失败，使用 clone 模式: {e}")
+        return FETCH_MODE_CLONE
+
+    mode = FETCH_MODE_SNAPSHOT if size_kb >= SNAPSHOT_AUTO_MIN_KB else FETCH_MODE_CLONE
+    logger.info(f"仓库大小 {size_kb} KB，auto 选择 {mode} 模式")
+    return mode
@@ -0,0 +1,423 @@
+"""抓取流量控制：按主机 / token 限制并发、令牌桶限速，并遵循限流退避信号。"""
+
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+from urllib.error import HTTPError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 默认配置，可通过环境变量覆盖
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_MAX_PER_TOKEN = 2
+DEFAULT_RATE_PER_SECOND = 2.0
+DEFAULT_BURST = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BASE_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+
+# 未携带 token 的请求共用同一个并发槽位（GitHub 按 IP 限流）
+ANONYMOUS_TOKEN_KEY = "anonymous"
+
+# 从 git / gitingest 错误信息中识别限流；429 只在 HTTP 状态码的上下文中匹配，
+# 避免误判仓库名或路径中出现的数字
+_THROTTLE_MESSAGE_PATTERN = re.compile(
+    r"rate limit|too many requests|abuse detection"
+    r"|\bHTTP(?:/[\d.]+)?\s+429\b|\berror:?\s+429\b|\bstatus(?: code)?:?\s+429\b",
+    re.IGNORECASE
+)
+
+
+class ThrottledError(RuntimeError):
+    """上游返回了限流信号。"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """
+    解析 Retry-After 头，支持秒数和 HTTP 日期两种格式。
+
+    Returns:
+        需要等待的秒数；无法解析时返回 None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (now if now is not None else time.time()))
+
+
+def _throttle_delay(exc: BaseException) -> tuple[bool, Optional[float]]:
+    """
+    判断异常是否为限流信号，并提取建议的等待时间。
+
+    Returns:
+        (is_throttled, retry_after)
+    """
+    if isinstance(exc, ThrottledError):
+        return True, exc.retry_after
+
+    if isinstance(exc, HTTPError):
+        headers = exc.headers or {}
+        retry_after = _parse_retry_after(headers.get("Retry-After"))
+        if exc.code == 429:
+            return True, retry_after
+        # GitHub 的主 / 次级限流使用 403 + 限流头
+        if exc.code == 403:
+            if retry_after is not None:
+                return True, retry_after
+            if headers.get("X-RateLimit-Remaining") == "0":
+                reset = headers.get("X-RateLimit-Reset")
+                try:
+                    return True, max(0.0, float(reset) - time.time())
+                except (TypeError, ValueError):
+                    return True, None
+        return False, None
+
+    if _THROTTLE_MESSAGE_PATTERN.search(str(exc)):
+        return True, None
+    return False, None
+
+
+def token_key(token: Optional[str]) -> str:
+    """
+    token 的摘要，用作并发槽位和缓存键的一部分。
+
+    token 只以摘要形式保存，避免出现在内存结构、日志和缓存文件中。
+    """
+    if not token:
+        return ANONYMOUS_TOKEN_KEY
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:12]
+
+
+class TokenBucket:
+    """线程安全的令牌桶。"""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """扣除一个令牌，返回需要等待的秒数（令牌可以透支）。"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self) -> float:
+        """
+        获取一个令牌，必要时阻塞。
+
+        Returns:
+            实际等待的秒数
+        """
+        if self.rate <= 0:
+            return 0.0
+        delay = self._reserve()
+        if delay > 0:
+            self._sleep(delay)
+        return delay
+
+
+class FetchTiming:
+    """
+    单次请求的抓取状态：截止时间，以及写入 analyze_repo metadata 的等待统计。
+
+    Args:
+        deadline: 可选的截止时间（与 FetchGovernor 的时钟一致，默认 time.monotonic()），
+                  超过后不再排队、等待退避或重试
+    """
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self.wait_seconds = 0.0
+        self.attempts = 0
+        self.throttled = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "wait_seconds": round(self.wait_seconds, 3),
+            "attempts": self.attempts,
+            "throttled": self.throttled,
+        }
+
+
+class FetchGovernor:
+    """
+    统一调度对上游（GitHub 等）的克隆和 API 请求。
+
+    - 每个主机、每个 token 的并发上限
+    - 每个主机的令牌桶限速
+    - 遇到 429 / 限流 403 时遵循 Retry-After，否则指数退避；
+      退避期间同一主机的其他请求也会等待，避免集体重试加重限流
+    - 统计排队、限速和退避的等待时间
+    """
+
+    def __init__(
+        self,
+        max_per_host: int = DEFAULT_MAX_PER_HOST,
+        max_per_token: int = DEFAULT_MAX_PER_TOKEN,
+        rate_per_second: float = DEFAULT_RATE_PER_SECOND,
+        burst: int = DEFAULT_BURST,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_backoff: float = DEFAULT_BASE_BACKOFF,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.max_per_host = max_per_host
+        self.max_per_token = max_per_token
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._clock = clock
+        self._sleep = sleep
+
+        self._lock = threading.Lock()
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._token_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _host_state(self, host: str) -> tuple[threading.BoundedSemaphore, TokenBucket]:
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+                self._buckets[host] = TokenBucket(
+                    self.rate_per_second, self.burst, clock=self._clock, sleep=self._sleep
+                )
+                self._stats[host] = {
+                    "requests": 0,
+                    "throttled": 0,
+                    "wait_seconds": 0.0,
+                }
+            return self._host_slots[host], self._buckets[host]
+
+    def _token_slot(self, token: Optional[str]) -> threading.BoundedSemaphore:
+        key = token_key(token)
+        with self._lock:
+            if key not in self._token_slots:
+                self._token_slots[key] = threading.BoundedSemaphore(self.max_per_token)
+            return self._token_slots[key]
+
+    def _record(self, host: str, wait: float = 0.0, requests: int = 0, throttled: int = 0):
+        with self._lock:
+            stats = self._stats[host]
+            stats["wait_seconds"] += wait
+            stats["requests"] += requests
+            stats["throttled"] += throttled
+
+    def _wait_for_backoff(
+        self,
+        host: str,
+        waited_until: float = 0.0,
+        deadline: Optional[float] = None
+    ) -> tuple[float, float]:
+        """
+        等待该主机的全局退避窗口结束。
+
+        Args:
+            host: 目标主机
+            waited_until: 已经等待过的窗口终点，不再重复等待
+            deadline: 可选的截止时间，窗口在此之后才结束时不等待
+
+        Returns:
+            (等待秒数, 当前窗口终点)
+
+        Raises:
+            RuntimeError: 如果退避窗口超过截止时间
+        """
+        with self._lock:
+            blocked_until = self._blocked_until.get(host, 0.0)
+        if blocked_until <= waited_until:
+            return 0.0, waited_until
+        if deadline is not None and blocked_until > deadline:
+            raise RuntimeError(f"{host} is rate limited beyond the request deadline")
+        delay = blocked_until - self._clock()
+        if delay > 0:
+            self._sleep(delay)
+            return delay, blocked_until
+        return 0.0, blocked_until
+
+    def _acquire(self, semaphore: threading.BoundedSemaphore, deadline: Optional[float]):
+        """获取信号量，到截止时间仍未获取时报错。"""
+        if deadline is None:
+            semaphore.acquire()
+        elif not semaphore.acquire(timeout=max(0.0, deadline - self._clock())):
+            raise RuntimeError("Deadline passed while waiting for a fetch slot")
+
+    @contextmanager
+    def slot(
+        self,
+        host: str,
+        token: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> Iterator[float]:
+        """
+        占用一个抓取槽位。
+
+        Args:
+            host: 目标主机，如 github.com
+            token: 请求使用的 token（可选）
+            deadline: 可选的截止时间，超过后不再排队或等待退避
+
+        Yields:
+            获取槽位过程中等待的秒数
+
+        Raises:
+            RuntimeError: 如果截止时间之前无法获取槽位
+        """
+        host_slot, bucket = self._host_state(host)
+        token_slot = self._token_slot(token)
+
+        start = self._clock()
+        if deadline is not None and start >= deadline:
+            raise RuntimeError("Deadline passed before the fetch started")
+        waited, waited_until = self._wait_for_backoff(host, deadline=deadline)
+        # 固定先主机后 token 的顺序，避免死锁
+        self._acquire(host_slot, deadline)
+        try:
+            self._acquire(token_slot, deadline)
+            try:
+                # 排队期间其他请求可能触发了限流，拿到槽位后再检查，
+                # 持有槽位等待直到没有新的退避窗口
+                while True:
+                    delay, blocked_until = self._wait_for_backoff(host, waited_until, deadline)
+                    if blocked_until == waited_until:
+                        break
+                    waited += delay
+                    waited_until = blocked_until
+                waited += bucket.acquire()
+                waited = max(waited, self._clock() - start)
+                self._record(host, wait=waited, requests=1)
+                yield waited
+            finally:
+                token_slot.release()
+        finally:
+            host_slot.release()
+
+    def _backoff_delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        # 指数退避 + full jitter
+        ceiling = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def call(
+        self,
+        host: str,
+        token: Optional[str],
+        fn: Callable[[], T],
+        timing: Optional[FetchTiming] = None,
+    ) -> T:
+        """
+        在流量控制下执行一次抓取，遇到限流时自动退避重试。
+
+        Args:
+            host: 目标主机
+            token: 请求使用的 token（可选）
+            fn: 实际执行抓取的函数
+            timing: 可选，用于收集本次请求的等待统计；其截止时间之后不再排队或重试
+
+        Returns:
+            fn 的返回值
+
+        Raises:
+            fn 抛出的非限流异常；重试耗尽或退避会超过截止时间时抛出最后一次的限流异常；
+            截止时间之前无法获取槽位时抛出 RuntimeError
+        """
+        timing = timing or FetchTiming()
+        attempt = 0
+        while True:
+            timing.attempts += 1
+            with self.slot(host, token, timing.deadline) as waited:
+                timing.wait_seconds += waited
+                try:
+                    return fn()
+                except Exception as e:
+                    throttled, retry_after = _throttle_delay(e)
+                    if not throttled:
+                        raise
+                    error = e
+                    delay = self._backoff_delay(attempt, retry_after)
+                    # 在释放槽位之前登记退避窗口，排队中的请求拿到槽位后即可看到
+                    with self._lock:
+                        self._blocked_until[host] = max(
+                            self._blocked_until.get(host, 0.0), self._clock() + delay
+                        )
+
+            timing.throttled += 1
+            self._record(host, throttled=1)
+            if attempt >= self.max_retries:
+                logger.warning(f"{host} 限流，重试 {attempt} 次后放弃")
+                raise error
+            if timing.deadline is not None and self._clock() + delay >= timing.deadline:
+                logger.warning(f"{host} 限流，退避 {delay:.2f} 秒会超过截止时间，放弃重试")
+                raise error
+
+            attempt += 1
+            logger.warning(f"{host} 限流，{delay:.2f} 秒后第 {attempt} 次重试")
+            # 退避窗口在下一次 slot() 中等待，并计入等待时间
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """返回各主机的累计统计。"""
+        with self._lock:
+            return {host: dict(values) for host, values in self._stats.items()}
+
+
+_governor: Optional[FetchGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_fetch_governor() -> FetchGovernor:
+    """获取进程级共享的 FetchGovernor，配置从环境变量读取。"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = FetchGovernor(
+                max_per_host=int(os.getenv("FETCH_MAX_PER_HOST", DEFAULT_MAX_PER_HOST)),
+                max_per_token=int(os.getenv("FETCH_MAX_PER_TOKEN", DEFAULT_MAX_PER_TOKEN)),
+                rate_per_second=float(
+                    os.getenv("FETCH_RATE_PER_SECOND", DEFAULT_RATE_PER_SECOND)
+                ),
+                burst=int(os.getenv("FETCH_BURST", DEFAULT_BURST)),
+                max_retries=int(os.getenv("FETCH_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+            )
+        return _governor
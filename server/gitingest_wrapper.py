@@ -1,12 +1,38 @@
 """gitingest 库的封装。"""
 
 import os
+import time
+import posixpath
 import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
 from gitingest import ingest_async
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, List, Union
+from urllib.parse import urlparse
 import re
 import logging
 
+from server.blob_store import BlobStore, get_ingest_cache
+from server.compaction import ContentCompactor
+from server.fetch_backends import (
+    get_fetch_backend,
+    get_repo_size_kb,
+    resolve_commit_sha,
+    resolve_fetch_mode,
+)
+from server.fetch_governor import FetchTiming, get_fetch_governor, token_key
+from server.memory_governor import (
+    DEFAULT_MAX_FILE_SIZE,
+    DEFAULT_REQUEST_RESERVE_BYTES,
+    MemoryReservation,
+    RssSampler,
+    content_nbytes,
+    get_memory_governor,
+)
+
 logger = logging.getLogger(__name__)
 
 # 默认文档文件模式
@@ -18,7 +44,18 @@ README_ONLY_PATTERN = "README*,readme*"
 # 256k token 限制 - 粗略估计（约4字符/token）
 MAX_TOKEN_LIMIT = 256 * 1024
 # 转换为字符数估计（留一些余量）
-ESTIMATED_CHAR_LIMIT = MAX_TOKEN_LIMIT * 3
+CHARS_PER_TOKEN = 3
+ESTIMATED_CHAR_LIMIT = MAX_TOKEN_LIMIT * CHARS_PER_TOKEN
+
+# 内存控制：单文件上限、每个请求的预占字节
+INGEST_MAX_FILE_SIZE = int(os.getenv("INGEST_MAX_FILE_SIZE", DEFAULT_MAX_FILE_SIZE))
+REQUEST_RESERVE_BYTES = int(
+    os.getenv("INGEST_REQUEST_RESERVE_BYTES", DEFAULT_REQUEST_RESERVE_BYTES)
+)
+
+# analyze_repos：全服务共享的并发上限，以及预算分配策略
+ANALYZE_REPOS_MAX_WORKERS = int(os.getenv("ANALYZE_REPOS_MAX_WORKERS", 4))
+BUDGET_STRATEGIES = ("priority", "equal", "size")
 
 
 def _parse_github_url(url: str) -> tuple[str, Optional[str]]:
@@ -46,6 +83,46 @@ def _parse_github_url(url: str) -> tuple[str, Optional[str]]:
     return repo_path, subdirectory
 
 
+def _normalize_subdirectory(subdirectory: Optional[str]) -> Optional[str]:
+    """
+    规范化子目录路径，拒绝绝对路径和包含 .. 的路径，避免读取仓库以外的文件。
+
+    Returns:
+        规范化后的相对路径；为空或指向仓库根目录时返回 None
+
+    Raises:
+        ValueError: 如果子目录是绝对路径或包含 ..
+    """
+    if subdirectory is None:
+        return None
+    path = subdirectory.strip().replace("\\", "/")
+    if path.startswith("/") or re.match(r"^[A-Za-z]:", path) or ".." in path.split("/"):
+        raise ValueError(f"Invalid subdirectory: {subdirectory}")
+    path = posixpath.normpath(path) if path else ""
+    return None if path in ("", ".") else path
+
+
+def _parse_github_branch(url: str) -> Optional[str]:
+    """
+    从 /tree/<branch>/ 形式的 URL 中解析分支名。
+    """
+    match = re.search(r"github\.com/[^/]+/[^/?]+/tree/([^/?]+)", url)
+    return match.group(1) if match else None
+
+
+def _time_left(deadline: float) -> float:
+    """
+    返回距截止时间的秒数。
+
+    Raises:
+        RuntimeError: 如果已经超过截止时间
+    """
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise RuntimeError("Deadline passed before the analysis finished")
+    return remaining
+
+
 def _estimate_tokens(text: str) -> int:
     """
     估算文本的 token 数量。
@@ -53,90 +130,219 @@ def _estimate_tokens(text: str) -> int:
     粗略估计：英文约 4 字符/token，中文约 2 字符/token。
     这里使用保守估计 3 字符/token。
     """
-    return len(text) // 3
+    return len(text) // CHARS_PER_TOKEN
 
 
 def _ingest_with_retry(
     full_url: str,
     include_patterns: Optional[str],
     timeout: int,
-    force_readme_mode: bool
+    force_readme_mode: bool,
+    github_token: Optional[str] = None,
+    timing: Optional[FetchTiming] = None,
+    reservation: Optional[MemoryReservation] = None,
+    max_tokens: int = MAX_TOKEN_LIMIT,
+    compactor: Optional[ContentCompactor] = None
 ) -> tuple[str, str, str, bool]:
     """
     执行 ingest，如果结果超过限制且未强制 README 模式，则自动降级。
 
+    每次 ingest 都经过 FetchGovernor 调度，受主机 / token 并发和限速约束；
+    结果计入内存预算。指定 compactor 时先压缩内容再检查 token 限制。
+
     Returns:
         (summary, tree, content, was_fallback)
     """
-    summary, tree, content = _run_ingest(full_url, include_patterns, timeout)
+    summary, tree, content = _governed_ingest(
+        full_url, include_patterns, timeout, github_token, timing
+    )
+    content = _admit_content(content, reservation, compactor)
 
     # 检查内容大小
     estimated_tokens = _estimate_tokens(content)
-    logger.info(f"估算 token 数: {estimated_tokens}, 限制: {MAX_TOKEN_LIMIT}")
+    logger.info(f"估算 token 数: {estimated_tokens}, 限制: {max_tokens}")
 
     # 如果超过限制且未强制 README 模式，自动降级
-    if estimated_tokens > MAX_TOKEN_LIMIT and not force_readme_mode:
-        logger.warning(f"内容超过 {MAX_TOKEN_LIMIT} token，自动降级到 README 模式")
-        summary, tree, content = _run_ingest(full_url, README_ONLY_PATTERN, timeout)
-        return summary, tree, content, True
+    if estimated_tokens > max_tokens and not force_readme_mode:
+        logger.warning(f"内容超过 {max_tokens} token，自动降级到 README 模式")
+        # 先释放超限内容，避免与降级结果同时驻留内存
+        del content
+        if reservation is not None:
+            reservation.resize(0)
+        if compactor is not None:
+            compactor.reset()
+        summary, tree, content = _governed_ingest(
+            full_url, README_ONLY_PATTERN, timeout, github_token, timing
+        )
+        return summary, tree, _admit_content(content, reservation, compactor), True
 
     return summary, tree, content, False
 
 
+def _admit_content(
+    content: str,
+    reservation: Optional[MemoryReservation],
+    compactor: Optional[ContentCompactor] = None
+) -> str:
+    """
+    将 ingest 结果计入内存预算，指定 compactor 时逐个文件压缩。
+    """
+    if reservation is not None:
+        reservation.resize(content_nbytes(content))
+    if compactor is not None:
+        content = compactor.compact(content)
+        if reservation is not None:
+            reservation.resize(content_nbytes(content))
+    return content
+
+
+def _governed_ingest(
+    full_url: str,
+    include_patterns: Optional[str],
+    timeout: int,
+    github_token: Optional[str],
+    timing: Optional[FetchTiming]
+) -> tuple[str, str, str]:
+    """
+    在 FetchGovernor 控制下执行 gitingest。本地目录直接读取，不经过调度。
+
+    timing 带有截止时间时，排队、退避和之前阶段用掉的时间从 timeout 中扣除。
+    """
+    def ingest() -> tuple[str, str, str]:
+        remaining = timeout
+        if timing is not None and timing.deadline is not None:
+            remaining = min(timeout, _time_left(timing.deadline))
+        return _run_ingest(
+            full_url, include_patterns, remaining, INGEST_MAX_FILE_SIZE, github_token
+        )
+
+    host = urlparse(full_url).hostname
+    if host is None:
+        return ingest()
+    return get_fetch_governor().call(host, github_token, ingest, timing=timing)
+
+
 def _run_ingest(
     full_url: str,
     include_patterns: Optional[str],
-    timeout: int
+    timeout: int,
+    max_file_size: int = DEFAULT_MAX_FILE_SIZE,
+    github_token: Optional[str] = None
 ) -> tuple[str, str, str]:
     """
-    执行 gitingest 获取内容。
+    执行 gitingest 获取内容。超过 max_file_size 的文件会被跳过。
+
+    Raises:
+        RuntimeError: 如果超过 timeout 仍未完成
+    """
+    result = {}
+    exception = None
+
+    def run_ingest():
+        nonlocal exception
+        try:
+            # 在协程内部也设置超时，克隆等异步阶段可以被及时取消
+            result["data"] = asyncio.run(asyncio.wait_for(
+                ingest_async(
+                    full_url,
+                    include_patterns=include_patterns,
+                    max_file_size=max_file_size,
+                    token=github_token
+                ),
+                timeout
+            ))
+        except Exception as e:
+            exception = e
+
+    # ingest_async 读取文件的阶段是同步的，无法被取消；始终在独立线程中运行，
+    # 超时后放弃等待，调用线程（如共享线程池的工作线程）立即返回。
+    # 同时避免与调用方已经运行的事件循环冲突
+    thread = threading.Thread(target=run_ingest, name="gitingest", daemon=True)
+    thread.start()
+    thread.join(timeout=timeout)
+
+    if thread.is_alive() or isinstance(exception, asyncio.TimeoutError):
+        raise RuntimeError(f"Ingest timed out after {timeout} seconds")
+    if exception:
+        raise exception
+    if "data" not in result:
+        raise RuntimeError("Ingest failed")
+    return result["data"]
+
+
+@contextmanager
+def _fetched_source(
+    fetch_mode: str,
+    full_url: str,
+    repo_path: str,
+    ref: Optional[str],
+    subdirectory: Optional[str],
+    include_patterns: Optional[str],
+    github_token: Optional[str],
+    timeout: int,
+    timing: FetchTiming
+) -> Iterator[str]:
+    """
+    按抓取模式准备 ingest 的来源。
+
+    clone 模式直接返回远程 URL，由 gitingest 自行克隆；
+    其他模式先由对应后端物化到临时目录，再以本地路径 ingest，
+    README 降级时也无需重新下载。
+    """
+    backend = get_fetch_backend(fetch_mode)
+    if backend is None:
+        yield full_url
+        return
+
+    # 部分抓取的后端也要带上 README，保证降级时无需重新抓取
+    if include_patterns and include_patterns != README_ONLY_PATTERN:
+        include_patterns = f"{include_patterns},{README_ONLY_PATTERN}"
+
+    with tempfile.TemporaryDirectory(prefix="gitingest-fetch-") as workdir:
+        # 目录名决定 gitingest 摘要中显示的名称
+        dest_dir = os.path.join(workdir, repo_path.split("/")[-1])
+        root = backend.fetch(
+            repo_path,
+            ref,
+            dest_dir,
+            token=github_token,
+            subdirectory=subdirectory,
+            include_patterns=include_patterns,
+            timeout=timeout,
+            timing=timing,
+        )
+        if not subdirectory:
+            yield root
+            return
+        source = os.path.realpath(os.path.join(root, subdirectory))
+        real_root = os.path.realpath(root)
+        # 子目录可能是指向仓库以外的符号链接
+        if os.path.commonpath([source, real_root]) != real_root:
+            raise ValueError(f"Invalid subdirectory: {subdirectory}")
+        yield source
+
+
+def _read_cache(
+    cache: Optional[BlobStore],
+    key: Dict[str, Any]
+) -> Optional[tuple[str, str, Dict[str, Any]]]:
+    """
+    从缓存重组 ingest 结果。
+
+    Returns:
+        (summary, content, metadata)，未命中或 blob 已被淘汰时返回 None
     """
-    # 使用 ingest_async 并处理事件循环
+    if cache is None:
+        return None
+    manifest = cache.get(key)
+    if manifest is None:
+        return None
     try:
-        loop = asyncio.get_event_loop()
-        # 如果已经有运行中的事件循环，使用 run_until_complete
-        if loop.is_running():
-            # 在新线程中运行以避免事件循环冲突
-            import threading
-            import traceback
-            result = {}
-            exception = None
-
-            def run_ingest():
-                nonlocal exception
-                try:
-                    new_loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(new_loop)
-                    coro = ingest_async(full_url, include_patterns=include_patterns)
-                    try:
-                        r = new_loop.run_until_complete(coro)
-                        result['data'] = r
-                    except Exception as e:
-                        traceback.print_exc()
-                        exception = e
-                except Exception as e:
-                    traceback.print_exc()
-                    exception = e
-                finally:
-                    new_loop.close()
-
-            thread = threading.Thread(target=run_ingest)
-            thread.start()
-            thread.join(timeout=timeout)
-
-            if thread.is_alive():
-                raise RuntimeError(f"Ingest timed out after {timeout} seconds")
-            if exception:
-                raise exception
-            if 'data' not in result:
-                raise RuntimeError("Ingest failed")
-
-            return result['data']
-        else:
-            return loop.run_until_complete(ingest_async(full_url, include_patterns=include_patterns))
-    except RuntimeError:
-        # 没有事件循环，创建新的
-        return asyncio.run(ingest_async(full_url, include_patterns=include_patterns))
+        content = cache.assemble(manifest)
+    except OSError as e:
+        logger.warning(f"缓存条目不完整，重新抓取: {e}")
+        return None
+    return manifest["summary"], content, manifest["metadata"]
 
 
 def analyze_repo(
@@ -146,7 +352,10 @@ def analyze_repo(
     default_branch: Optional[str] = None,
     timeout: int = 120,
     include_patterns: Optional[str] = None,
-    fallback_to_readme: Optional[bool] = None
+    fallback_to_readme: Optional[bool] = None,
+    fetch_mode: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    compact: Optional[bool] = None
 ) -> Dict[str, Any]:
     """
     分析 GitHub 仓库。
@@ -156,22 +365,32 @@ def analyze_repo(
         subdirectory: 可选的子目录路径
         github_token: 可选的 GitHub token（用于私有仓库）
         default_branch: 可选的默认分支名（默认为 'main'，也可指定为 'master' 等）
-        timeout: 超时时间（秒），默认为 120
+        timeout: 超时时间（秒），默认为 120。覆盖整个请求：排队、限流退避、
+                 等待内存预算和 ingest 共用这段时间
         include_patterns: 可选的文件包含模式（逗号分隔）。如未指定，默认使用文档文件模式。
                          设置为 "all" 可分析所有文件。
         fallback_to_readme: 可选，强制只分析 README。如未指定，当内容超过 256k token 时自动降级。
+        fetch_mode: 可选的抓取模式：clone（gitingest 浅克隆）、snapshot（tarball 快照）、
+                    sparse（按 include_patterns / 子目录的部分克隆）或 auto（自动选择）。
+                    如未指定，读取环境变量 FETCH_MODE，默认 clone。
+        max_tokens: 可选的 token 预算，超过时自动降级到 README 模式。默认为 256k。
+        compact: 可选，返回前压缩内容（重复文件替换为引用、去掉重复的许可证头、
+                 清理空白、截断生成文件），在检查 token 预算之前进行。默认不压缩。
 
     Returns:
-        包含 summary, content, metadata 的字典
+        包含 summary, content, metadata 的字典。内存预算只覆盖抓取、ingest 和压缩阶段，
+        返回之后（包括调用方序列化响应时）content 不再计入。
 
     Raises:
-        ValueError: 如果 URL 格式无效
+        ValueError: 如果 URL 格式、子目录或抓取模式无效
         OSError: 如果无法访问仓库
         RuntimeError: 如果 gitingest 调用失败
     """
+    deadline = time.monotonic() + timeout
+
     # 验证 URL
     repo_path, url_subdir = _parse_github_url(url)
-    final_subdir = subdirectory or url_subdir
+    final_subdir = _normalize_subdirectory(subdirectory or url_subdir)
     branch = default_branch or "main"
 
     # 处理 include_patterns：默认使用文档模式，"all" 表示全部文件
@@ -190,31 +409,108 @@ def analyze_repo(
         include_patterns = README_ONLY_PATTERN
         logger.info("强制使用 README 模式")
 
-    # 安全地设置 token
-    original_token = os.environ.get("GITHUB_TOKEN")
-    try:
-        if github_token:
-            os.environ["GITHUB_TOKEN"] = github_token
-
-        # 调用 gitingest（带自动降级）
+    # 调用 gitingest（带自动降级）
+    if final_subdir:
+        full_url = f"https://github.com/{repo_path}/tree/{branch}/{final_subdir}"
+    else:
+        full_url = url
+
+    # token 显式传给 gitingest，不修改进程环境变量（并发请求之间互不影响）
+    token = github_token or os.environ.get("GITHUB_TOKEN")
+    limit = max_tokens or MAX_TOKEN_LIMIT
+    ref = default_branch or _parse_github_branch(url)
+    timing = FetchTiming(deadline)
+    cache = get_ingest_cache()
+    commit = None
+    if cache is not None:
+        # 按提交 SHA 缓存：分支更新后不会命中旧内容，相邻提交各自一条 manifest、共享 blob
+        try:
+            commit = resolve_commit_sha(repo_path, ref, token, timing=timing)
+        except Exception as e:
+            logger.warning(f"无法解析 {repo_path}@{ref or 'HEAD'} 的提交，跳过缓存: {e}")
+            cache = None
+    # 抓取固定到解析出的提交，缓存的内容与键中的 SHA 一致（分支在两次请求之间更新也不会错位）；
+    # 未启用缓存或解析失败时按分支抓取
+    if commit is not None:
+        fetch_ref = commit
+        fetch_url = f"https://github.com/{repo_path}/tree/{commit}"
         if final_subdir:
-            full_url = f"https://github.com/{repo_path}/tree/{branch}/{final_subdir}"
-        else:
-            full_url = url
-
-        summary, tree, content, was_fallback = _ingest_with_retry(
-            full_url=full_url,
-            include_patterns=include_patterns,
-            timeout=timeout,
-            force_readme_mode=force_readme_mode
-        )
-
-    finally:
-        # 恢复原始状态
-        if original_token is None:
-            os.environ.pop("GITHUB_TOKEN", None)
+            fetch_url = f"{fetch_url}/{final_subdir}"
+    else:
+        fetch_ref = ref
+        fetch_url = full_url
+    # token 摘要也是键的一部分，私有仓库的结果不会返回给其他调用方
+    cache_key = {
+        "repo": repo_path,
+        "commit": commit,
+        "subdirectory": final_subdir,
+        "include_patterns": include_patterns,
+        "force_readme_mode": force_readme_mode,
+        "token_budget": limit,
+        "max_file_size": INGEST_MAX_FILE_SIZE,
+        "token": token_key(token),
+        "compact": bool(compact),
+    }
+    memory = get_memory_governor()
+    with RssSampler() as rss, memory.reserve(
+        REQUEST_RESERVE_BYTES, timeout=_time_left(deadline)
+    ) as reservation:
+        cached = _read_cache(cache, cache_key)
+        if cached is not None:
+            summary, content, cached_metadata = cached
+            was_fallback = cached_metadata.get("was_fallback", False)
+            compaction = cached_metadata.get("compaction")
+            resolved_mode = "cache"
+            reservation.resize(content_nbytes(content))
+            logger.info(f"缓存命中: {repo_path}@{commit}")
         else:
-            os.environ["GITHUB_TOKEN"] = original_token
+            compactor = ContentCompactor() if compact else None
+            resolved_mode = resolve_fetch_mode(
+                fetch_mode, repo_path, token, timing,
+                include_patterns=include_patterns, subdirectory=final_subdir
+            )
+            with _fetched_source(
+                resolved_mode,
+                fetch_url,
+                repo_path,
+                fetch_ref,
+                final_subdir,
+                include_patterns,
+                token,
+                _time_left(deadline),
+                timing
+            ) as source:
+                summary, tree, content, was_fallback = _ingest_with_retry(
+                    full_url=source,
+                    include_patterns=include_patterns,
+                    timeout=timeout,
+                    force_readme_mode=force_readme_mode,
+                    github_token=token,
+                    timing=timing,
+                    reservation=reservation,
+                    max_tokens=limit,
+                    compactor=compactor
+                )
+                if source != fetch_url:
+                    # 本地物化时摘要里是临时目录路径，替换为仓库名
+                    summary = re.sub(
+                        r"^Directory: .*$", f"Repository: {repo_path}", summary,
+                        count=1, flags=re.MULTILINE
+                    )
+            compaction = None
+            if compactor is not None:
+                compaction = {
+                    **compactor.to_dict(),
+                    "tokens_saved": compactor.chars_saved // CHARS_PER_TOKEN,
+                }
+            if cache is not None:
+                try:
+                    cache.put(
+                        cache_key, content, summary,
+                        {"was_fallback": was_fallback, "compaction": compaction}
+                    )
+                except OSError as e:
+                    logger.warning(f"写入缓存失败: {e}")
 
     # 构建返回结果
     estimated_tokens = _estimate_tokens(content)
@@ -230,6 +526,263 @@ def analyze_repo(
             "source_url": full_url,
             "include_patterns": include_patterns,
             "was_fallback": was_fallback,
-            "fallback_reason": "Content exceeded 256k token limit" if was_fallback else None,
+            "fallback_reason": (
+                f"Content exceeded {limit // 1024}k token limit" if was_fallback else None
+            ),
+            "token_budget": limit,
+            "fetch_mode": resolved_mode,
+            "fetch": timing.to_dict(),
+            "cache": {
+                "enabled": cache is not None,
+                "hit": cached is not None,
+                "commit": commit,
+            },
+            "compaction": compaction,
+            "memory": {
+                **rss.to_dict(),
+                "content_bytes": content_nbytes(content),
+                "max_file_size": INGEST_MAX_FILE_SIZE,
+            },
         }
     }
+
+
+# analyze_repos 中可以按仓库单独指定的参数
+_PER_REPO_OPTIONS = (
+    "subdirectory",
+    "default_branch",
+    "include_patterns",
+    "fallback_to_readme",
+    "fetch_mode",
+    "compact",
+)
+
+_repos_executor: Optional[ThreadPoolExecutor] = None
+_repos_executor_lock = threading.Lock()
+
+
+def _get_repos_executor() -> ThreadPoolExecutor:
+    """
+    获取全服务共享的线程池，多个 analyze_repos 请求共用同一个并发上限。
+    """
+    global _repos_executor
+    with _repos_executor_lock:
+        if _repos_executor is None:
+            _repos_executor = ThreadPoolExecutor(
+                max_workers=ANALYZE_REPOS_MAX_WORKERS, thread_name_prefix="analyze-repos"
+            )
+        return _repos_executor
+
+
+def _normalize_repo_specs(repos: List[Union[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    把 URL 字符串或参数字典统一为参数字典。
+
+    Raises:
+        ValueError: 如果列表为空或某项缺少 url
+    """
+    if not repos:
+        raise ValueError("repos must not be empty")
+
+    specs = []
+    for repo in repos:
+        spec = {"url": repo} if isinstance(repo, str) else dict(repo)
+        if not spec.get("url"):
+            raise ValueError(f"Missing url in repo spec: {repo}")
+        specs.append(spec)
+    return specs
+
+
+def split_token_budget(
+    specs: List[Dict[str, Any]],
+    total_tokens: int,
+    strategy: str = "priority",
+    github_token: Optional[str] = None,
+    deadline: Optional[float] = None
+) -> List[int]:
+    """
+    把总 token 预算分配给各个仓库。
+
+    Args:
+        specs: 仓库参数列表
+        total_tokens: 总 token 预算
+        strategy: priority（按 priority 字段加权，默认 1）、equal（平均）
+                  或 size（按 GitHub API 返回的仓库大小加权，查询失败的按 1 计）
+        github_token: 可选的 GitHub token，用于查询仓库大小
+        deadline: 可选的截止时间（time.monotonic()），查询仓库大小时不会排队或重试超过它
+
+    Returns:
+        与 specs 一一对应的 token 预算
+
+    Raises:
+        ValueError: 如果策略未知或 priority 非正数
+    """
+    if strategy == "equal":
+        weights = [1.0] * len(specs)
+    elif strategy == "priority":
+        weights = [float(spec.get("priority", 1)) for spec in specs]
+        if any(weight <= 0 for weight in weights):
+            raise ValueError("priority must be positive")
+    elif strategy == "size":
+        weights = []
+        for spec in specs:
+            try:
+                repo_path, _ = _parse_github_url(spec["url"])
+                size_kb = get_repo_size_kb(
+                    repo_path, github_token, timing=FetchTiming(deadline)
+                )
+                weights.append(float(max(1, size_kb)))
+            except Exception as e:
+                logger.warning(f"查询 {spec['url']} 大小失败，按 1 计: {e}")
+                weights.append(1.0)
+    else:
+        raise ValueError(f"Unknown budget strategy: {strategy}")
+
+    total_weight = sum(weights)
+    return [max(1, int(total_tokens * weight / total_weight)) for weight in weights]
+
+
+def _analyze_repo_until(deadline: float, url: str, **kwargs: Any) -> Dict[str, Any]:
+    """
+    在整体截止时间之前分析单个仓库，在线程池中排队的时间从超时中扣除。
+
+    Raises:
+        RuntimeError: 如果开始时已经超过截止时间
+    """
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise RuntimeError("Deadline passed before analysis started")
+    return analyze_repo(url, timeout=remaining, **kwargs)
+
+
+def iter_analyze_repos(
+    repos: List[Union[str, Dict[str, Any]]],
+    total_tokens: int = MAX_TOKEN_LIMIT,
+    budget_strategy: str = "priority",
+    github_token: Optional[str] = None,
+    timeout: int = 120,
+    **defaults: Any
+) -> Iterator[Dict[str, Any]]:
+    """
+    并发分析多个仓库，按完成顺序逐个产出结果。
+
+    所有仓库共享一个 token 预算；并发受全服务共享线程池以及
+    FetchGovernor / MemoryGovernor 的限制。超过 timeout 仍未完成的仓库
+    以 timeout 状态返回，不会拖住其他仓库；到截止时间时放弃等待其 ingest，
+    及时归还共享线程池、抓取槽位和内存预算。
+
+    Args:
+        repos: 仓库 URL，或包含 url 及可选 priority / subdirectory / default_branch /
+               include_patterns / fallback_to_readme / fetch_mode 的字典
+        total_tokens: 总 token 预算，默认为 256k
+        budget_strategy: 预算分配策略，见 split_token_budget
+        github_token: 可选的 GitHub token
+        timeout: 整体超时时间（秒）
+        **defaults: 各仓库未单独指定时使用的 analyze_repo 参数
+
+    Yields:
+        {"index", "url", "status", "token_budget", "result" 或 "error"}，
+        status 为 ok / error / timeout
+    """
+    # 截止时间从请求开始计算，按大小分配预算时的 API 查询也计入超时
+    deadline = time.monotonic() + timeout
+    specs = _normalize_repo_specs(repos)
+    budgets = split_token_budget(
+        specs, total_tokens, budget_strategy, github_token, deadline=deadline
+    )
+    executor = _get_repos_executor()
+
+    futures = {}
+    for index, (spec, budget) in enumerate(zip(specs, budgets)):
+        options = {key: defaults.get(key) for key in _PER_REPO_OPTIONS}
+        options.update({key: spec[key] for key in _PER_REPO_OPTIONS if key in spec})
+        future = executor.submit(
+            _analyze_repo_until,
+            deadline,
+            spec["url"],
+            github_token=github_token,
+            max_tokens=budget,
+            **options
+        )
+        futures[future] = (index, spec["url"], budget)
+
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+            pending.discard(future)
+            index, url, budget = futures[future]
+            item = {"index": index, "url": url, "token_budget": budget}
+            try:
+                item.update(status="ok", result=future.result())
+            except Exception as e:
+                logger.warning(f"分析 {url} 失败: {e}")
+                item.update(status="error", error=str(e))
+            yield item
+    except FuturesTimeoutError:
+        pass
+    finally:
+        # 调用方提前结束或整体超时：取消尚未开始的任务
+        for future in pending:
+            future.cancel()
+
+    for future in sorted(pending, key=lambda f: futures[f][0]):
+        index, url, budget = futures[future]
+        yield {
+            "index": index,
+            "url": url,
+            "token_budget": budget,
+            "status": "timeout",
+            "error": f"Analysis did not finish within {timeout} seconds",
+        }
+
+
+def analyze_repos(
+    repos: List[Union[str, Dict[str, Any]]],
+    total_tokens: int = MAX_TOKEN_LIMIT,
+    budget_strategy: str = "priority",
+    github_token: Optional[str] = None,
+    timeout: int = 120,
+    **defaults: Any
+) -> Dict[str, Any]:
+    """
+    并发分析多个仓库并汇总结果，参数同 iter_analyze_repos。
+
+    Returns:
+        包含 results（按输入顺序）和 summary 的字典
+    """
+    results = sorted(
+        iter_analyze_repos(
+            repos,
+            total_tokens=total_tokens,
+            budget_strategy=budget_strategy,
+            github_token=github_token,
+            timeout=timeout,
+            **defaults
+        ),
+        key=lambda item: item["index"],
+    )
+    return {
+        "results": results,
+        "summary": summarize_repos_results(results, total_tokens, budget_strategy),
+    }
+
+
+def summarize_repos_results(
+    results: List[Dict[str, Any]],
+    total_tokens: int,
+    budget_strategy: str
+) -> Dict[str, Any]:
+    """
+    汇总 analyze_repos 的结果。
+    """
+    succeeded = [item for item in results if item["status"] == "ok"]
+    return {
+        "total_repos": len(results),
+        "succeeded": len(succeeded),
+        "failed": len(results) - len(succeeded),
+        "total_token_budget": total_tokens,
+        "budget_strategy": budget_strategy,
+        "estimated_tokens": sum(
+            item["result"]["summary"]["estimated_tokens"] for item in succeeded
+        ),
+    }
@@ -1,8 +1,10 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
+import json
 import os
-from server.mcp_handler import handle_mcp_request
+from server.mcp_handler import handle_mcp_request, is_streaming_request, iter_mcp_request
 
 load_dotenv()
 
@@ -28,12 +30,20 @@ def health_check():
 
 @app.post("/mcp")
 async def mcp_endpoint(request: Request):
-    """MCP 协议端点。"""
+    """MCP 协议端点。客户端接受 text/event-stream 时，analyze_repos 以 SSE 流式返回部分结果。"""
     body = await request.json()
+    if "text/event-stream" in request.headers.get("accept", "") and is_streaming_request(body):
+        return StreamingResponse(_sse_events(body), media_type="text/event-stream")
     response = handle_mcp_request(body)
     return response
 
 
+def _sse_events(body):
+    """把 MCP 消息编码为 SSE 事件。同步生成器由 Starlette 放到线程池中迭代。"""
+    for message in iter_mcp_request(body):
+        yield f"event: message\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
@@ -1,7 +1,7 @@
 """MCP 协议处理。"""
 
 from pydantic import BaseModel
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 from enum import Enum
 
 
@@ -60,10 +60,99 @@ AVAILABLE_TOOLS = [
                 "fallback_to_readme": {
                     "type": "boolean",
                     "description": "可选：强制只分析 README 文件。默认为自动检测，当内容超过 256k token 时自动降级到 README 模式。"
+                },
+                "fetch_mode": {
+                    "type": "string",
+                    "enum": ["clone", "snapshot", "sparse", "auto"],
+                    "description": (
+                        "可选：抓取方式。clone 为浅克隆（默认），snapshot 下载 tarball 快照"
+                        "（无 git 历史，单次读取更快），sparse 只下载匹配 include_patterns / "
+                        "子目录的文件，auto 自动选择。"
+                    )
+                },
+                "compact": {
+                    "type": "boolean",
+                    "description": (
+                        "可选：精简输出。重复文件替换为引用，去掉重复的许可证头和多余空白，"
+                        "截断锁文件等生成文件。默认为 false。"
+                    )
                 }
             },
             "required": ["url"]
         }
+    ),
+    Tool(
+        name="analyze_repos",
+        description="并发分析多个 GitHub 仓库（如服务与其 SDK、fork 与上游），共享一个 token 预算",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "repos": {
+                    "type": "array",
+                    "description": (
+                        "仓库列表。每项为 URL 字符串，或包含 url 及可选 priority、subdirectory、"
+                        "default_branch、include_patterns、fallback_to_readme、fetch_mode、"
+                        "compact 的对象"
+                    ),
+                    "items": {
+                        "oneOf": [
+                            {"type": "string"},
+                            {
+                                "type": "object",
+                                "properties": {
+                                    "url": {"type": "string"},
+                                    "priority": {"type": "number"},
+                                    "subdirectory": {"type": "string"},
+                                    "default_branch": {"type": "string"},
+                                    "include_patterns": {"type": "string"},
+                                    "fallback_to_readme": {"type": "boolean"},
+                                    "fetch_mode": {"type": "string"},
+                                    "compact": {"type": "boolean"}
+                                },
+                                "required": ["url"]
+                            }
+                        ]
+                    },
+                    "minItems": 1
+                },
+                "total_tokens": {
+                    "type": "integer",
+                    "description": "可选：所有仓库共享的 token 预算（默认 256k）"
+                },
+                "budget_strategy": {
+                    "type": "string",
+                    "enum": ["priority", "equal", "size"],
+                    "description": (
+                        "可选：预算分配方式。priority 按 priority 加权（默认），"
+                        "equal 平均分配，size 按仓库大小加权"
+                    )
+                },
+                "github_token": {
+                    "type": "string",
+                    "description": "可选：用于私有仓库的 GitHub token"
+                },
+                "include_patterns": {
+                    "type": "string",
+                    "description": "可选：各仓库默认的文件包含模式，可在单个仓库中覆盖"
+                },
+                "fetch_mode": {
+                    "type": "string",
+                    "enum": ["clone", "snapshot", "sparse", "auto"],
+                    "description": "可选：各仓库默认的抓取方式，可在单个仓库中覆盖"
+                },
+                "compact": {
+                    "type": "boolean",
+                    "description": "可选：各仓库默认是否精简输出，可在单个仓库中覆盖"
+                },
+                "timeout": {
+                    "type": "integer",
+                    "description": (
+                        "可选：整体超时时间（秒），超时未完成的仓库单独标记为 timeout，默认 120"
+                    )
+                }
+            },
+            "required": ["repos"]
+        }
     )
 ]
 
@@ -95,6 +184,21 @@ def handle_tools_list() -> Dict[str, Any]:
     }
 
 
+def _analyze_repos_kwargs(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """从工具参数中提取 analyze_repos 的参数，未提供的使用默认值。"""
+    keys = (
+        "total_tokens",
+        "budget_strategy",
+        "github_token",
+        "include_patterns",
+        "fetch_mode",
+        "compact",
+        "timeout",
+    )
+    kwargs = {key: arguments[key] for key in keys if arguments.get(key) is not None}
+    return {"repos": arguments.get("repos"), **kwargs}
+
+
 def handle_tools_call(params: Dict[str, Any]) -> Dict[str, Any]:
     """处理 tools/call 请求。"""
     tool_name = params.get("name")
@@ -108,11 +212,19 @@ def handle_tools_call(params: Dict[str, Any]) -> Dict[str, Any]:
             github_token=arguments.get("github_token"),
             default_branch=arguments.get("default_branch"),
             include_patterns=arguments.get("include_patterns"),
-            fallback_to_readme=arguments.get("fallback_to_readme")
+            fallback_to_readme=arguments.get("fallback_to_readme"),
+            fetch_mode=arguments.get("fetch_mode"),
+            compact=arguments.get("compact")
         )
         return {
             "content": [{"type": "text", "text": str(result)}]
         }
+    elif tool_name == "analyze_repos":
+        from server.gitingest_wrapper import analyze_repos
+        result = analyze_repos(**_analyze_repos_kwargs(arguments))
+        return {
+            "content": [{"type": "text", "text": str(result)}]
+        }
     else:
         raise ValueError(f"Unknown tool: {tool_name}")
 
@@ -196,6 +308,15 @@ def handle_mcp_request(request: Dict[str, Any]) -> Dict[str, Any]:
     except Exception as e:
         error = {"code": -32603, "message": str(e)}
 
+    return _build_response(request_id, result, error)
+
+
+def _build_response(
+    request_id: Any,
+    result: Optional[Dict[str, Any]],
+    error: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """构建 JSON-RPC 响应。"""
     response = {
         "jsonrpc": "2.0",
         "id": request_id
@@ -207,3 +328,76 @@ def handle_mcp_request(request: Dict[str, Any]) -> Dict[str, Any]:
         response["error"] = error
 
     return response
+
+
+def _notification(method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """构建 JSON-RPC 通知。"""
+    return {"jsonrpc": "2.0", "method": method, "params": params}
+
+
+def is_streaming_request(request: Dict[str, Any]) -> bool:
+    """是否为支持流式返回部分结果的请求（目前只有 analyze_repos）。"""
+    params = request.get("params") or {}
+    return (
+        request.get("method") == MCPMessageType.TOOLS_CALL
+        and params.get("name") == "analyze_repos"
+    )
+
+
+def iter_mcp_request(request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    以流式方式处理 MCP 请求。
+
+    analyze_repos 每完成一个仓库就产出一条 notifications/message（data 为该仓库结果），
+    请求带 _meta.progressToken 时同时产出 notifications/progress，最后产出完整响应。
+    其他请求只产出一条响应。
+
+    Args:
+        request: MCP 请求字典
+
+    Yields:
+        JSON-RPC 通知或响应字典
+    """
+    if not is_streaming_request(request):
+        yield handle_mcp_request(request)
+        return
+
+    from server.gitingest_wrapper import (
+        MAX_TOKEN_LIMIT,
+        iter_analyze_repos,
+        summarize_repos_results,
+    )
+
+    request_id = request.get("id")
+    params = request.get("params") or {}
+    progress_token = (params.get("_meta") or {}).get("progressToken")
+    kwargs = _analyze_repos_kwargs(params.get("arguments") or {})
+
+    results = []
+    try:
+        for item in iter_analyze_repos(**kwargs):
+            results.append(item)
+            if progress_token is not None:
+                yield _notification("notifications/progress", {
+                    "progressToken": progress_token,
+                    "progress": len(results),
+                    "total": len(kwargs["repos"]),
+                    "message": f"{item['url']}: {item['status']}",
+                })
+            yield _notification("notifications/message", {
+                "level": "info",
+                "logger": "analyze_repos",
+                "data": item,
+            })
+    except Exception as e:
+        yield _build_response(request_id, None, {"code": -32603, "message": str(e)})
+        return
+
+    results.sort(key=lambda item: item["index"])
+    summary = summarize_repos_results(
+        results,
+        kwargs.get("total_tokens", MAX_TOKEN_LIMIT),
+        kwargs.get("budget_strategy", "priority"),
+    )
+    result = {"results": results, "summary": summary}
+    yield _build_response(request_id, {"content": [{"type": "text", "text": str(result)}]}, None)
@@ -0,0 +1,162 @@
+"""内存控制：单文件大小上限、全局在途字节预算和 RSS 采样。"""
+
+import logging
+import os
+import sys
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 单个文件的大小上限，超过的文件由 gitingest 跳过
+DEFAULT_MAX_FILE_SIZE = 2 * 1024 * 1024
+# 所有请求在内存中持有内容的总预算
+DEFAULT_MEMORY_BUDGET_BYTES = 512 * 1024 * 1024
+# 每个请求开始 ingest 前预占的字节数（准入控制）
+DEFAULT_REQUEST_RESERVE_BYTES = 64 * 1024 * 1024
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class MemoryReservation:
+    """在 MemoryGovernor 中的一笔预占。"""
+
+    def __init__(self, governor: "MemoryGovernor", nbytes: int):
+        self._governor = governor
+        self.nbytes = nbytes
+
+    def resize(self, nbytes: int):
+        """
+        调整预占大小。
+
+        内容已经在内存中，因此增大时不会阻塞，只记账；
+        减小时会唤醒等待中的请求。
+        """
+        self._governor._adjust(nbytes - self.nbytes)
+        self.nbytes = nbytes
+
+    def release(self):
+        self.resize(0)
+
+    def __enter__(self) -> "MemoryReservation":
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class MemoryGovernor:
+    """
+    全局在途字节预算。
+
+    请求在 ingest 前预占一定字节，预算不足时阻塞等待；
+    空闲时即使单个请求超过预算也会放行，避免永久阻塞。
+    """
+
+    def __init__(self, budget_bytes: int = DEFAULT_MEMORY_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    @property
+    def in_flight(self) -> int:
+        with self._cond:
+            return self._in_flight
+
+    def reserve(self, nbytes: int, timeout: Optional[float] = None) -> MemoryReservation:
+        """
+        预占字节，预算不足时阻塞。
+
+        Args:
+            nbytes: 预占字节数
+            timeout: 可选，最长等待秒数
+
+        Returns:
+            MemoryReservation，可作为上下文管理器使用
+
+        Raises:
+            RuntimeError: 如果等待超时
+        """
+        with self._cond:
+            admitted = self._cond.wait_for(
+                lambda: self._in_flight == 0 or self._in_flight + nbytes <= self.budget_bytes,
+                timeout=timeout,
+            )
+            if not admitted:
+                raise RuntimeError(f"Memory budget exhausted, waited {timeout} seconds")
+            self._in_flight += nbytes
+        return MemoryReservation(self, nbytes)
+
+    def _adjust(self, delta: int):
+        with self._cond:
+            self._in_flight = max(0, self._in_flight + delta)
+            if delta < 0:
+                self._cond.notify_all()
+
+
+def content_nbytes(content: str) -> int:
+    """内容在内存中占用的字节数。"""
+    return sys.getsizeof(content)
+
+
+def _current_rss_bytes() -> int:
+    """当前进程 RSS；没有 /proc 时退回 ru_maxrss。"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 单位为字节，Linux 为 KB
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class RssSampler:
+    """在请求期间后台采样进程 RSS，记录峰值。"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.start_bytes = 0
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        self.peak_bytes = max(self.peak_bytes, _current_rss_bytes())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> "RssSampler":
+        self.start_bytes = _current_rss_bytes()
+        self.peak_bytes = self.start_bytes
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "peak_rss_bytes": self.peak_bytes,
+            "peak_rss_delta_bytes": max(0, self.peak_bytes - self.start_bytes),
+        }
+
+
+_governor: Optional[MemoryGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_memory_governor() -> MemoryGovernor:
+    """获取进程级共享的 MemoryGovernor，预算从环境变量读取。"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = MemoryGovernor(
+                int(os.getenv("INGEST_MEMORY_BUDGET_BYTES", DEFAULT_MEMORY_BUDGET_BYTES))
+            )
+        return _governor
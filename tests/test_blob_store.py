@@ -0,0 +1,129 @@
+import time
+
+import pytest
+
+from server.blob_store import BlobStore, content_digest
+
+SEP = "=" * 48
+
+
+def _render(files, preamble=""):
+    """按 gitingest 格式拼接文件块。"""
+    blocks = [f"{SEP}\n{header}\n{SEP}\n{body}\n\n" for header, body in files]
+    return preamble + "\n".join(blocks)
+
+
+FILES = [
+    ("FILE: README.md", "# Demo\n\nhello\n"),
+    ("FILE: docs/guide.md", "guide\n\n\n"),
+    ("SYMLINK: latest -> docs/guide.md", ""),
+    ("FILE: LICENSE", "MIT License\n"),
+]
+
+
+class TestBlobStore:
+    """测试内容寻址的 ingest 缓存。"""
+
+    def test_round_trip_is_exact(self, tmp_path):
+        """重组后的内容与原始内容逐字节一致。"""
+        store = BlobStore(str(tmp_path))
+        content = _render(FILES, preamble="Directory: demo\n")
+
+        manifest = store.put({"repo": "owner/demo"}, content, "Summary", {"was_fallback": True})
+        cached = store.get({"repo": "owner/demo"})
+
+        assert cached["id"] == manifest["id"]
+        assert cached["summary"] == "Summary"
+        assert cached["metadata"] == {"was_fallback": True}
+        assert store.assemble(cached) == content
+        assert store.get({"repo": "owner/other"}) is None
+
+    def test_forks_share_blobs(self, tmp_path):
+        """fork 之间相同的文件只存一份。"""
+        store = BlobStore(str(tmp_path))
+        base = [(f"FILE: src/f{i}.py", f"print({i})\n" * 100) for i in range(10)]
+        fork = base[:-1] + [("FILE: src/f9.py", "patched\n")]
+
+        store.put({"repo": "upstream/lib"}, _render(base), "")
+        store.put({"repo": "fork/lib"}, _render(fork), "")
+
+        stats = store.stats()
+        assert stats["manifests"] == 2
+        assert stats["blobs"] == 11
+        assert stats["dedup_ratio"] > 1.8
+
+    def test_eviction_keeps_shared_blobs(self, tmp_path):
+        """淘汰 manifest 只删除引用归零的 blob。"""
+        shared = ("FILE: LICENSE", "L" * 1000)
+        store = BlobStore(str(tmp_path), max_bytes=2500)
+
+        store.put({"repo": "a"}, _render([shared, ("FILE: a.txt", "a" * 1000)]), "")
+        store.put({"repo": "b"}, _render([shared, ("FILE: b.txt", "b" * 1000)]), "")
+
+        # 超过容量，最久未使用的 a 被淘汰
+        assert store.get({"repo": "a"}) is None
+        remaining = store.get({"repo": "b"})
+        assert "L" * 1000 in store.assemble(remaining)
+        assert store.stats()["blobs"] == 2
+        assert store.blob_bytes <= 2500
+
+    def test_get_refreshes_lru_order(self, tmp_path):
+        """读取过的条目不会被优先淘汰。"""
+        store = BlobStore(str(tmp_path), max_bytes=2500)
+        store.put({"repo": "a"}, _render([("FILE: a.txt", "a" * 1000)]), "")
+        store.put({"repo": "b"}, _render([("FILE: b.txt", "b" * 1000)]), "")
+        store.get({"repo": "a"})
+
+        store.put({"repo": "c"}, _render([("FILE: c.txt", "c" * 1000)]), "")
+
+        assert store.get({"repo": "a"}) is not None
+        assert store.get({"repo": "b"}) is None
+
+    def test_overwrite_same_key_keeps_reused_blobs(self, tmp_path):
+        """覆盖同一个键时，新旧内容共享的 blob 不会被删除。"""
+        store = BlobStore(str(tmp_path))
+        store.put({"repo": "a"}, _render(FILES), "")
+        changed = FILES[:-1] + [("FILE: LICENSE", "Apache\n")]
+
+        store.put({"repo": "a"}, _render(changed), "")
+
+        assert store.assemble(store.get({"repo": "a"})) == _render(changed)
+        assert store.stats()["manifests"] == 1
+
+    def test_ttl_expiry(self, tmp_path):
+        """过期条目视为未命中并被删除。"""
+        store = BlobStore(str(tmp_path), ttl_seconds=10)
+        manifest = store.put({"repo": "a"}, _render(FILES), "")
+        manifest_path = tmp_path / "manifests" / f"{manifest['id']}.json"
+
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(time, "time", lambda: manifest["created"] + 11)
+            assert store.get({"repo": "a"}) is None
+
+        assert not manifest_path.exists()
+        assert store.stats()["blobs"] == 0
+
+    def test_reload_rebuilds_index(self, tmp_path):
+        """重新打开缓存目录时重建引用计数并清理孤立 blob。"""
+        store = BlobStore(str(tmp_path))
+        content = _render(FILES)
+        store.put({"repo": "a"}, content, "Summary")
+        orphan = tmp_path / "blobs" / "ff" / ("0" * 38)
+        orphan.parent.mkdir(exist_ok=True)
+        orphan.write_bytes(b"orphan")
+
+        reopened = BlobStore(str(tmp_path))
+
+        assert reopened.stats() == store.stats()
+        assert reopened.assemble(reopened.get({"repo": "a"})) == content
+        assert not orphan.exists()
+
+    def test_blob_named_by_content_digest(self, tmp_path):
+        """blob 以内容摘要命名，位置不同的相同文件得到同一个 blob。"""
+        store = BlobStore(str(tmp_path))
+        store.put({"repo": "a"}, _render([("FILE: a/x.txt", "héllo\n")]), "")
+        store.put({"repo": "b"}, _render([("FILE: b/x.txt", "héllo\n\n\n")]), "")
+
+        sha = content_digest("héllo\n".encode("utf-8"))
+        assert (tmp_path / "blobs" / sha[:2] / sha[2:]).read_bytes() == "héllo\n".encode("utf-8")
+        assert store.stats()["blobs"] == 1
@@ -0,0 +1,153 @@
+from server.compaction import ContentCompactor
+from server.content_format import iter_file_blocks
+
+SEP = "=" * 48
+LICENSE = "# Copyright (c) Example\n# Licensed under MIT\n# See LICENSE for details\n"
+
+
+def _render(files, preamble=""):
+    """按 gitingest 格式拼接文件块。"""
+    blocks = [f"{SEP}\nFILE: {path}\n{SEP}\n{body}\n\n" for path, body in files]
+    return preamble + "\n".join(blocks)
+
+
+def _bodies(content):
+    return {
+        block.path: block.body.rstrip("\n")
+        for block in iter_file_blocks([content]) if block.header
+    }
+
+
+class TestContentCompactor:
+    """测试精简输出。"""
+
+    def test_duplicate_files_replaced_with_reference(self):
+        """相同的文件只保留第一份。"""
+        body = "def helper():\n    return 42\n"
+        compactor = ContentCompactor()
+
+        result = compactor.compact(_render([("a/util.py", body), ("b/util.py", body)]))
+
+        bodies = _bodies(result)
+        assert bodies["a/util.py"] == body.rstrip("\n")
+        assert bodies["b/util.py"] == "[duplicate of a/util.py]"
+        assert compactor.duplicates == 1
+
+    def test_repeated_license_header_stripped(self):
+        """重复的许可证头只保留第一份，shebang 保留。"""
+        compactor = ContentCompactor()
+        content = _render([
+            ("a.py", LICENSE + "import os\n"),
+            ("b.py", "#!/usr/bin/env python\n" + LICENSE + "import sys\n"),
+        ])
+
+        bodies = _bodies(compactor.compact(content))
+
+        assert bodies["a.py"] == LICENSE + "import os"
+        assert bodies["b.py"] == (
+            "#!/usr/bin/env python\n[header omitted: same as a.py]\nimport sys"
+        )
+        assert compactor.headers_stripped == 1
+
+    def test_short_comments_kept(self):
+        """不足最小行数的头注释不视为样板。"""
+        compactor = ContentCompactor()
+        content = _render([("a.py", "# util\nx = 1\n"), ("b.py", "# util\ny = 2\n")])
+
+        assert compactor.compact(content) == content
+        assert compactor.chars_saved == 0
+
+    def test_whitespace_trimmed(self):
+        """去掉行尾空白，连续空行压缩到上限。"""
+        compactor = ContentCompactor(max_blank_lines=1)
+        content = _render([("notes.md", "title   \r\n\n\n\n\nbody\t\n")])
+
+        assert _bodies(compactor.compact(content))["notes.md"] == "title\n\nbody"
+
+    def test_generated_files_truncated(self):
+        """锁文件、带生成标记和压缩过的文件被截断。"""
+        compactor = ContentCompactor(truncate_chars=100)
+        lock = "\n".join(f"pkg{i}==1.0" for i in range(100))
+        generated = "// Code generated by protoc. DO NOT EDIT.\n" + "x = 1\n" * 100
+        minified = "var a=1;" * 500
+        content = _render([
+            ("poetry.lock", lock),
+            ("api.go", generated),
+            ("dist/app.js", minified),
+            ("main.py", "y = 2\n" * 100),
+        ])
+
+        bodies = _bodies(compactor.compact(content))
+
+        assert bodies["poetry.lock"].endswith("more chars]")
+        assert len(bodies["poetry.lock"]) < 200
+        assert "[truncated generated file" in bodies["api.go"]
+        assert "[truncated generated file" in bodies["dist/app.js"]
+        assert bodies["main.py"] == ("y = 2\n" * 100).rstrip("\n")
+        assert compactor.truncated == 3
+
+    def test_unwrapped_prose_not_truncated(self):
+        """不换行的长段落文档不视为压缩文件。"""
+        compactor = ContentCompactor()
+        paragraph = "This guide explains the configuration options in detail. " * 12
+        guide = "\n\n".join([paragraph.strip()] * 10)
+        content = _render([
+            ("docs/guide.md", guide),
+            ("notes.txt", guide + " notes"),
+            ("docs/index.rst", guide + " index"),
+        ])
+
+        bodies = _bodies(compactor.compact(content))
+
+        assert bodies["docs/guide.md"] == guide
+        assert bodies["notes.txt"] == guide + " notes"
+        assert bodies["docs/index.rst"] == guide + " index"
+        assert compactor.truncated == 0
+
+    def test_generated_marker_in_prose_not_truncated(self):
+        """文档正文提到 auto-generated 时不截断；代码中不在注释里的同样字样也不算。"""
+        compactor = ContentCompactor(truncate_chars=100)
+        readme = "# Client\n\nThis SDK is auto-generated from the OpenAPI spec.\n" + "usage\n" * 100
+        code = 'MESSAGE = "DO NOT EDIT"\n' + "x = 1\n" * 100
+        notes = "<!-- auto-generated -->\n" + "note\n" * 100
+        content = _render([("README.md", readme), ("consts.py", code), ("docs/notes.md", notes)])
+
+        bodies = _bodies(compactor.compact(content))
+
+        assert bodies["README.md"] == readme.rstrip("\n")
+        assert bodies["consts.py"] == code.rstrip("\n")
+        assert bodies["docs/notes.md"] == notes.rstrip("\n")
+        assert compactor.truncated == 0
+
+    def test_preamble_and_block_separators_preserved(self):
+        """开头的非文件内容和块之间的分隔保持不变。"""
+        compactor = ContentCompactor()
+        content = _render([("a.md", "one\n"), ("b.md", "two\n")], preamble="Directory: x\n")
+
+        assert compactor.compact(content) == content
+        assert compactor.files == 2
+
+    def test_stats(self):
+        """统计压缩前后的字符数。"""
+        body = "line   \n" * 200
+        content = _render([(f"f{i}.txt", body + str(i)) for i in range(20)])
+        compactor = ContentCompactor()
+
+        text = compactor.compact(content)
+
+        assert compactor.chars_before == len(content)
+        assert compactor.chars_after == len(text)
+        assert compactor.chars_saved == 20 * 200 * 3
+        assert compactor.to_dict()["files"] == 20
+
+    def test_reset(self):
+        """reset 后重新统计，已见文件清空。"""
+        compactor = ContentCompactor()
+        content = _render([("a.txt", "same content\n"), ("b.txt", "same content\n")])
+        compactor.compact(content)
+
+        compactor.reset()
+        result = compactor.compact(_render([("b.txt", "same content\n")]))
+
+        assert "[duplicate" not in result
+        assert compactor.duplicates == 0
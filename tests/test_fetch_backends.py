@@ -0,0 +1,378 @@
+import io
+import json
+import os
+import subprocess
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+
+from server import fetch_backends, fetch_governor
+from server.fetch_backends import (
+    GitCloneBackend,
+    SnapshotBackend,
+    SparseCloneBackend,
+    get_fetch_backend,
+    resolve_fetch_mode,
+    sparse_checkout_patterns,
+)
+from server.fetch_governor import FetchGovernor
+from server.gitingest_wrapper import analyze_repo
+
+
+def _make_tarball(files: dict, top: str = "repo-abc123") -> bytes:
+    """构造与 codeload 相同布局（带顶层目录）的 tar.gz。"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(f"{top}/{name}")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class _StaticServer:
+    """本地替身服务：按路径返回固定内容，整数表示只返回该状态码。"""
+
+    def __init__(self, routes: dict):
+        self.routes = routes
+        self.paths = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.paths.append(self.path)
+                body = server.routes.get(self.path)
+                if body is None or isinstance(body, int):
+                    self.send_response(body or 404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _make_git_remote(root, files: dict) -> str:
+    """在 root/owner/repo.git 创建允许部分克隆过滤的本地仓库，返回 file:// 基地址。"""
+    source = root / "owner" / "repo"
+    source.mkdir(parents=True)
+    for name, data in files.items():
+        path = source / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    for args in (
+        ["init", "-q", "-b", "main"],
+        ["add", "."],
+        ["-c", "user.name=t", "-c", "user.email=t@t", "commit", "-qm", "init"],
+        ["config", "uploadpack.allowFilter", "true"],
+    ):
+        subprocess.run(["git", *args], cwd=source, check=True)
+    os.rename(source, str(source) + ".git")
+    return f"file://{root}"
+
+
+def _list_files(root: str) -> list:
+    return sorted(
+        os.path.relpath(os.path.join(dirpath, name), root)
+        for dirpath, dirnames, filenames in os.walk(root)
+        if ".git" not in dirpath.split(os.sep)
+        for name in filenames
+    )
+
+
+@pytest.fixture(autouse=True)
+def unthrottled_governor():
+    """测试中不限速。"""
+    with patch.object(fetch_governor, "_governor", FetchGovernor(rate_per_second=0)):
+        yield
+
+
+FILES = {
+    "README.md": b"# Demo\n",
+    "docs/guide.md": "指南\n".encode("utf-8"),
+    "src/main.py": b"print('hi')\n",
+}
+
+
+class TestSnapshotBackend:
+    """测试 tarball 快照后端。"""
+
+    def test_fetch_extracts_without_top_dir(self, tmp_path):
+        """解压时去掉顶层目录。"""
+        with _StaticServer({"/owner/repo/tar.gz/HEAD": _make_tarball(FILES)}) as server:
+            root = SnapshotBackend(server.url).fetch("owner/repo", None, str(tmp_path / "repo"))
+
+        assert open(os.path.join(root, "README.md"), "rb").read() == b"# Demo\n"
+        assert os.path.exists(os.path.join(root, "src", "main.py"))
+        assert not os.path.exists(os.path.join(root, "repo-abc123"))
+
+    def test_fetch_only_subdirectory(self, tmp_path):
+        """指定子目录时只解压该目录。"""
+        with _StaticServer({"/owner/repo/tar.gz/dev": _make_tarball(FILES)}) as server:
+            root = SnapshotBackend(server.url).fetch(
+                "owner/repo", "dev", str(tmp_path / "repo"), subdirectory="docs"
+            )
+
+        assert os.path.exists(os.path.join(root, "docs", "guide.md"))
+        assert not os.path.exists(os.path.join(root, "README.md"))
+
+    def test_rejects_path_traversal(self, tmp_path):
+        """拒绝越界路径。"""
+        tarball = _make_tarball({"../../evil.txt": b"x"})
+        with _StaticServer({"/owner/repo/tar.gz/HEAD": tarball}) as server:
+            with pytest.raises(ValueError, match="Unsafe path"):
+                SnapshotBackend(server.url).fetch("owner/repo", None, str(tmp_path / "repo"))
+
+
+class TestGitCloneBackend:
+    """测试本地仓库的浅克隆。"""
+
+    def test_shallow_clone(self, tmp_path):
+        """克隆本地仓库。"""
+        backend = GitCloneBackend(_make_git_remote(tmp_path, FILES))
+        root = backend.fetch("owner/repo", "main", str(tmp_path / "out"))
+
+        assert _list_files(root) == ["README.md", "docs/guide.md", "src/main.py"]
+
+
+def _commit(remote: str, files: dict) -> str:
+    """在 _make_git_remote 创建的仓库中追加一个提交，返回新提交之前的 SHA。"""
+    source = os.path.join(remote[len("file://"):], "owner", "repo.git")
+    previous = subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=source, capture_output=True, text=True, check=True
+    ).stdout.strip()
+    for name, data in files.items():
+        with open(os.path.join(source, name), "wb") as f:
+            f.write(data)
+    subprocess.run(
+        ["git", "-c", "user.name=t", "-c", "user.email=t@t", "commit", "-qam", "update"],
+        cwd=source, check=True,
+    )
+    return previous
+
+
+class TestSparseCloneBackend:
+    """测试 blobless 部分克隆 + sparse-checkout。"""
+
+    def test_patterns_translation(self):
+        """include_patterns 和子目录翻译为 sparse 规则。"""
+        assert sparse_checkout_patterns(None, None) == (True, [])
+        assert sparse_checkout_patterns(None, "/docs/") == (True, ["docs"])
+        assert sparse_checkout_patterns("*.md, *.toml", None) == (False, ["*.md", "*.toml"])
+        assert sparse_checkout_patterns("*.md,api/*.yaml", "docs") == (
+            False, ["/docs/**/*.md", "/docs/api/*.yaml"]
+        )
+
+    def test_only_matching_blobs_downloaded(self, tmp_path):
+        """只检出并下载匹配模式的文件。"""
+        files = {**FILES, "src/big.bin": os.urandom(4096), "pyproject.toml": b"[project]\n"}
+        backend = SparseCloneBackend(_make_git_remote(tmp_path, files))
+        root = backend.fetch(
+            "owner/repo", "main", str(tmp_path / "out"), include_patterns="*.md,README*"
+        )
+
+        assert _list_files(root) == ["README.md", "docs/guide.md"]
+        missing = subprocess.run(
+            ["git", "rev-list", "--objects", "--all", "--missing=print"],
+            cwd=root, capture_output=True, text=True, check=True,
+        ).stdout.splitlines()
+        # src/main.py、src/big.bin、pyproject.toml 的 blob 都没有下载
+        assert len([line for line in missing if line.startswith("?")]) == 3
+
+    def test_fetch_by_commit_sha(self, tmp_path):
+        """按提交 SHA 抓取时检出该提交，仍然只下载匹配的文件。"""
+        remote = _make_git_remote(tmp_path, FILES)
+        sha = _commit(remote, {"README.md": b"# Updated\n"})
+
+        root = SparseCloneBackend(remote).fetch(
+            "owner/repo", sha, str(tmp_path / "out"), include_patterns="README*"
+        )
+
+        assert _list_files(root) == ["README.md"]
+        assert open(os.path.join(root, "README.md"), "rb").read() == b"# Demo\n"
+        missing = subprocess.run(
+            ["git", "rev-list", "--objects", "--all", "--missing=print"],
+            cwd=root, capture_output=True, text=True, check=True,
+        ).stdout.splitlines()
+        assert len([line for line in missing if line.startswith("?")]) == 2
+
+    def test_subdirectory_cone(self, tmp_path):
+        """只有子目录时使用 cone 模式。"""
+        backend = SparseCloneBackend(_make_git_remote(tmp_path, FILES))
+        root = backend.fetch("owner/repo", None, str(tmp_path / "out"), subdirectory="src")
+
+        # cone 模式总会包含根目录下的文件
+        assert _list_files(root) == ["README.md", "src/main.py"]
+
+
+class TestResolveFetchMode:
+    """测试抓取模式选择。"""
+
+    def test_explicit_modes(self):
+        """显式指定的模式原样返回。"""
+        assert resolve_fetch_mode("clone", "owner/repo") == "clone"
+        assert resolve_fetch_mode("snapshot", "owner/repo") == "snapshot"
+        assert get_fetch_backend("clone") is None
+        with pytest.raises(ValueError, match="Unknown fetch mode"):
+            resolve_fetch_mode("rsync", "owner/repo")
+
+    def test_auto_by_repo_size(self):
+        """auto 模式按仓库大小选择。"""
+        routes = {
+            "/repos/owner/big": json.dumps({"size": 10 ** 6}).encode(),
+            "/repos/owner/small": json.dumps({"size": 10}).encode(),
+        }
+        with _StaticServer(routes) as server:
+            with patch.object(fetch_backends, "GITHUB_API_URL", server.url):
+                assert resolve_fetch_mode("auto", "owner/big") == "snapshot"
+                assert resolve_fetch_mode("auto", "owner/small") == "clone"
+                # 查询失败时退回 clone
+                assert resolve_fetch_mode("auto", "owner/missing") == "clone"
+
+    def test_backend_base_is_abstract(self):
+        """后端基类不能直接实例化，子类必须实现 fetch。"""
+        with pytest.raises(TypeError):
+            fetch_backends.FetchBackend()
+
+    def test_resolve_commit_sha(self):
+        """分支名通过 API 解析为提交 SHA，未指定时解析 HEAD。"""
+        routes = {
+            "/repos/owner/repo/commits/HEAD": b"a" * 40,
+            "/repos/owner/repo/commits/feature%2Fx": b"b" * 40 + b"\n",
+        }
+        with _StaticServer(routes) as server:
+            with patch.object(fetch_backends, "GITHUB_API_URL", server.url):
+                assert fetch_backends.resolve_commit_sha("owner/repo") == "a" * 40
+                assert fetch_backends.resolve_commit_sha("owner/repo", "feature/x") == "b" * 40
+
+    def test_resolve_commit_sha_single_attempt(self):
+        """解析提交只尝试一次：限流时不重试，也不等待其他请求触发的退避窗口。"""
+        routes = {"/repos/owner/repo/commits/HEAD": 429}
+        with _StaticServer(routes) as server:
+            with patch.object(fetch_backends, "GITHUB_API_URL", server.url):
+                with pytest.raises(Exception):
+                    fetch_backends.resolve_commit_sha("owner/repo")
+                assert len(server.paths) == 1
+
+                governor = fetch_governor.get_fetch_governor()
+                governor._blocked_until["127.0.0.1"] = time.monotonic() + 60
+                start = time.monotonic()
+                with pytest.raises(RuntimeError, match="rate limited"):
+                    fetch_backends.resolve_commit_sha("owner/repo", timeout=1)
+                assert time.monotonic() - start < 1
+                assert len(server.paths) == 1
+
+    def test_auto_sparse_for_partial_ingest(self):
+        """auto 模式下部分文件的请求使用 sparse，且不查询仓库大小。"""
+        with patch.object(fetch_backends, "get_repo_size_kb") as mock_size:
+            assert resolve_fetch_mode("auto", "owner/repo", include_patterns="*.md") == "sparse"
+            assert resolve_fetch_mode("auto", "owner/repo", subdirectory="docs") == "sparse"
+        mock_size.assert_not_called()
+
+
+class TestAnalyzeRepoSnapshot:
+    """测试 analyze_repo 的快照模式。"""
+
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_ingests_local_snapshot(self, mock_ingest):
+        """快照模式下 gitingest 读取本地目录。"""
+        seen = {}
+
+        async def fake_ingest(source, **kwargs):
+            seen["source"] = source
+            seen["files"] = sorted(os.listdir(source))
+            return (f"Directory: {source}\nFiles analyzed: 3\n", "tree", "content")
+
+        mock_ingest.side_effect = fake_ingest
+
+        with _StaticServer({"/owner/repo/tar.gz/HEAD": _make_tarball(FILES)}) as server:
+            with patch.object(fetch_backends, "GITHUB_ARCHIVE_URL", server.url):
+                result = analyze_repo("https://github.com/owner/repo", fetch_mode="snapshot")
+
+        assert seen["files"] == ["README.md", "docs", "src"]
+        assert os.path.basename(seen["source"]) == "repo"
+        assert not os.path.exists(seen["source"])
+        assert result["summary"]["description"].startswith("Repository: owner/repo\n")
+        assert result["metadata"]["fetch_mode"] == "snapshot"
+        assert result["metadata"]["source_url"] == "https://github.com/owner/repo"
+
+
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_fetches_resolved_commit(self, mock_ingest, tmp_path, monkeypatch):
+        """启用缓存时按解析出的提交下载快照，内容与缓存键一致。"""
+        sha = "c" * 40
+        monkeypatch.setenv("INGEST_CACHE_DIR", str(tmp_path))
+        monkeypatch.setattr("server.gitingest_wrapper.resolve_commit_sha", lambda *a, **k: sha)
+        mock_ingest.return_value = ("Summary", "tree", "content")
+
+        with _StaticServer({f"/owner/repo/tar.gz/{sha}": _make_tarball(FILES)}) as server:
+            with patch.object(fetch_backends, "GITHUB_ARCHIVE_URL", server.url):
+                result = analyze_repo(
+                    "https://github.com/owner/repo/tree/main", fetch_mode="snapshot"
+                )
+
+        assert server.paths == [f"/owner/repo/tar.gz/{sha}"]
+        assert result["metadata"]["cache"]["commit"] == sha
+
+
+class TestAnalyzeRepoSparse:
+    """测试 analyze_repo 的 sparse 模式。"""
+
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_ingests_sparse_checkout(self, mock_ingest, tmp_path):
+        """默认文档模式只检出文档文件。"""
+        seen = {}
+
+        async def fake_ingest(source, **kwargs):
+            seen["source"] = source
+            seen["files"] = _list_files(source)
+            return ("Summary", "tree", "content")
+
+        mock_ingest.side_effect = fake_ingest
+        files = {**FILES, "pyproject.toml": b"[project]\n", "src/app.js": b"x"}
+
+        with patch.object(fetch_backends, "GITHUB_GIT_URL", _make_git_remote(tmp_path, files)):
+            result = analyze_repo("https://github.com/owner/repo", fetch_mode="sparse")
+
+        assert seen["files"] == ["README.md", "docs/guide.md", "pyproject.toml"]
+        assert result["metadata"]["fetch_mode"] == "sparse"
+
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_subdirectory_with_patterns(self, mock_ingest, tmp_path):
+        """子目录 + 模式：只检出子目录下匹配的文件，并 ingest 该子目录。"""
+        seen = {}
+
+        async def fake_ingest(source, **kwargs):
+            seen["source"] = source
+            seen["files"] = _list_files(os.path.dirname(source))
+            return ("Summary", "tree", "content")
+
+        mock_ingest.side_effect = fake_ingest
+
+        with patch.object(fetch_backends, "GITHUB_GIT_URL", _make_git_remote(tmp_path, FILES)):
+            analyze_repo(
+                "https://github.com/owner/repo/tree/main/docs",
+                include_patterns="*.md",
+                fetch_mode="sparse",
+            )
+
+        assert os.path.basename(seen["source"]) == "docs"
+        assert seen["files"] == ["docs/guide.md"]
@@ -0,0 +1,261 @@
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+
+import pytest
+
+from server.fetch_governor import (
+    FetchGovernor,
+    FetchTiming,
+    ThrottledError,
+    TokenBucket,
+    _parse_retry_after,
+    _throttle_delay,
+)
+
+
+class _ThrottlingServer:
+    """本地模拟 GitHub 的 HTTP 服务：前 N 个请求返回 429，并统计并发数。"""
+
+    def __init__(self, throttle_first: int = 0, retry_after: str = "0", delay: float = 0.0):
+        self.throttle_first = throttle_first
+        self.retry_after = retry_after
+        self.delay = delay
+        self.requests = 0
+        self.arrivals = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    server.arrivals.append(time.monotonic())
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                    throttled = server.requests <= server.throttle_first
+                try:
+                    time.sleep(server.delay)
+                    if throttled:
+                        self.send_response(429)
+                        self.send_header("Retry-After", server.retry_after)
+                        self.end_headers()
+                    else:
+                        self.send_response(200)
+                        self.end_headers()
+                        self.wfile.write(b"ok")
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _fetch(url: str) -> bytes:
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.read()
+
+
+class TestRetryAfter:
+    """测试限流信号解析。"""
+
+    def test_parse_seconds(self):
+        """测试秒数格式。"""
+        assert _parse_retry_after("7") == 7.0
+        assert _parse_retry_after(None) is None
+        assert _parse_retry_after("garbage") is None
+
+    def test_parse_http_date(self):
+        """测试 HTTP 日期格式。"""
+        delay = _parse_retry_after("Wed, 21 Oct 2015 07:28:30 GMT", now=1445412500.0)
+        assert delay == pytest.approx(10.0)
+
+    def test_detect_throttle_from_message(self):
+        """测试从 git 错误信息识别限流。"""
+        error = RuntimeError("The requested URL returned error: 429")
+        assert _throttle_delay(error) == (True, None)
+        assert _throttle_delay(ThrottledError("slow down", retry_after=3)) == (True, 3)
+        assert _throttle_delay(RuntimeError("Repository not found")) == (False, None)
+
+    def test_429_only_matched_as_status(self):
+        """仓库名或路径中的 429 不视为限流。"""
+        assert _throttle_delay(RuntimeError("HTTP 429 Too Many")) == (True, None)
+        assert _throttle_delay(RuntimeError("error: 429")) == (True, None)
+        assert _throttle_delay(RuntimeError("owner/repo-429 not found")) == (False, None)
+        assert _throttle_delay(RuntimeError("src/issue_429.py: exit 128")) == (False, None)
+
+
+class TestTokenBucket:
+    """测试令牌桶限速。"""
+
+    def test_burst_then_paced(self):
+        """突发额度用完后按速率等待。"""
+        now = [0.0]
+        sleeps = []
+        bucket = TokenBucket(rate=2.0, capacity=2, clock=lambda: now[0], sleep=sleeps.append)
+
+        assert bucket.acquire() == 0
+        assert bucket.acquire() == 0
+        assert bucket.acquire() == pytest.approx(0.5)
+        assert sleeps == [pytest.approx(0.5)]
+
+
+class TestFetchGovernor:
+    """使用本地限流服务测试 FetchGovernor。"""
+
+    def test_retries_after_throttle(self):
+        """429 后按 Retry-After 重试并记录等待。"""
+        sleeps = []
+        governor = FetchGovernor(rate_per_second=0, sleep=sleeps.append)
+        timing = FetchTiming()
+
+        with _ThrottlingServer(throttle_first=2, retry_after="1") as server:
+            body = governor.call("127.0.0.1", None, lambda: _fetch(server.url), timing=timing)
+
+        assert body == b"ok"
+        assert server.requests == 3
+        assert timing.attempts == 3
+        assert timing.throttled == 2
+        assert sleeps == [pytest.approx(1.0, abs=0.1)] * 2
+        assert governor.stats()["127.0.0.1"]["throttled"] == 2
+
+    def test_gives_up_after_max_retries(self):
+        """重试耗尽后抛出限流异常。"""
+        governor = FetchGovernor(rate_per_second=0, max_retries=1, sleep=lambda s: None)
+
+        with _ThrottlingServer(throttle_first=10) as server:
+            with pytest.raises(HTTPError) as excinfo:
+                governor.call("127.0.0.1", None, lambda: _fetch(server.url))
+
+        assert excinfo.value.code == 429
+        assert server.requests == 2
+
+    def test_no_retry_past_deadline(self):
+        """退避会超过截止时间时不再重试。"""
+        sleeps = []
+        governor = FetchGovernor(rate_per_second=0, sleep=sleeps.append)
+        timing = FetchTiming(deadline=time.monotonic() + 5)
+
+        with _ThrottlingServer(throttle_first=10, retry_after="60") as server:
+            with pytest.raises(HTTPError) as excinfo:
+                governor.call("127.0.0.1", None, lambda: _fetch(server.url), timing=timing)
+
+        assert excinfo.value.code == 429
+        assert server.requests == 1
+        assert sleeps == []
+
+        # 同一主机的后续请求也不会等待超过截止时间的退避窗口
+        with pytest.raises(RuntimeError, match="deadline"):
+            governor.call(
+                "127.0.0.1", None, lambda: b"ok", timing=FetchTiming(deadline=time.monotonic() + 5)
+            )
+        assert sleeps == []
+
+    def test_slot_wait_bounded_by_deadline(self):
+        """截止时间之前拿不到槽位时报错，而不是一直排队。"""
+        governor = FetchGovernor(max_per_host=1, rate_per_second=0)
+
+        with governor.slot("github.com"):
+            start = time.monotonic()
+            with pytest.raises(RuntimeError, match="fetch slot"):
+                governor.call(
+                    "github.com", None, lambda: b"ok",
+                    timing=FetchTiming(deadline=time.monotonic() + 0.2),
+                )
+            assert time.monotonic() - start < 1
+
+    def test_non_throttle_error_not_retried(self):
+        """非限流错误直接抛出。"""
+        governor = FetchGovernor()
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise RuntimeError("Repository not found")
+
+        with pytest.raises(RuntimeError, match="not found"):
+            governor.call("github.com", None, fail)
+        assert len(calls) == 1
+
+    def test_per_host_concurrency_cap(self):
+        """同一主机的并发数不超过上限。"""
+        governor = FetchGovernor(max_per_host=2, max_per_token=10, rate_per_second=0)
+
+        with _ThrottlingServer(delay=0.05) as server:
+            threads = [
+                threading.Thread(
+                    target=governor.call, args=("127.0.0.1", f"t{i}", lambda: _fetch(server.url))
+                )
+                for i in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert server.requests == 8
+        assert server.max_active <= 2
+
+    def test_per_token_concurrency_cap(self):
+        """同一 token 的并发数不超过上限。"""
+        governor = FetchGovernor(max_per_host=10, max_per_token=1, rate_per_second=0)
+        timings = [FetchTiming() for _ in range(4)]
+
+        with _ThrottlingServer(delay=0.05) as server:
+            threads = [
+                threading.Thread(
+                    target=governor.call,
+                    args=("127.0.0.1", "same-token", lambda: _fetch(server.url), timing),
+                )
+                for timing in timings
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert server.max_active == 1
+        assert sum(t.wait_seconds for t in timings) > 0
+
+    def test_queued_requests_respect_retry_after(self):
+        """排队中的请求拿到槽位后同样等待其他请求触发的退避窗口。"""
+        governor = FetchGovernor(max_per_host=1, max_per_token=10, rate_per_second=0)
+        timings = [FetchTiming() for _ in range(3)]
+
+        with _ThrottlingServer(throttle_first=1, retry_after="1", delay=0.2) as server:
+            threads = [
+                threading.Thread(
+                    target=governor.call,
+                    args=("127.0.0.1", f"t{i}", lambda: _fetch(server.url), timing),
+                )
+                for i, timing in enumerate(timings)
+            ]
+            for thread in threads:
+                thread.start()
+                # 第一个请求先占住主机槽位，其余请求排队
+                time.sleep(0.05)
+            for thread in threads:
+                thread.join()
+
+        first, *rest = server.arrivals
+        assert server.requests == 4
+        # 限流响应在第一个请求到达约 0.2 秒后返回，之后 1 秒内不应有请求到达
+        assert all(arrival >= first + 0.2 + 1.0 - 0.05 for arrival in rest)
+        assert all(timing.wait_seconds >= 0.9 for timing in timings[1:])
@@ -1,6 +1,17 @@
+import os
 import pytest
 from unittest.mock import patch, MagicMock
-from server.gitingest_wrapper import analyze_repo, _parse_github_url
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from server.gitingest_wrapper import (
+    analyze_repo,
+    analyze_repos,
+    iter_analyze_repos,
+    split_token_budget,
+    _fetched_source,
+    _parse_github_url,
+)
+from server.fetch_governor import FetchTiming
 
 
 class TestParseGitHubUrl:
@@ -99,3 +110,337 @@ class TestAnalyzeRepo:
     def test_analyze_repo_private_with_token(self):
         """测试私有仓库（带 token）。需要真实 token，暂时跳过。"""
         pytest.skip("Requires valid GitHub token")
+
+    @pytest.mark.parametrize("url, subdirectory", [
+        ("https://github.com/owner/repo", "/tmp/secretdir"),
+        ("https://github.com/owner/repo", "../secretdir"),
+        ("https://github.com/owner/repo", "docs/../../secretdir"),
+        ("https://github.com/owner/repo/tree/main/../../secretdir", None),
+    ])
+    @pytest.mark.parametrize("fetch_mode", ["clone", "snapshot", "sparse", "auto"])
+    @patch("server.gitingest_wrapper.get_fetch_backend")
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_analyze_repo_rejects_escaping_subdirectory(
+        self, mock_ingest, mock_backend, url, subdirectory, fetch_mode
+    ):
+        """测试绝对路径或包含 .. 的子目录在抓取前被拒绝。"""
+        with pytest.raises(ValueError, match="Invalid subdirectory"):
+            analyze_repo(url, subdirectory=subdirectory, fetch_mode=fetch_mode)
+
+        mock_backend.assert_not_called()
+        mock_ingest.assert_not_called()
+
+    @patch("server.gitingest_wrapper.get_fetch_backend")
+    def test_fetched_source_rejects_symlink_outside_checkout(self, mock_backend, tmp_path):
+        """测试指向检出目录以外的子目录符号链接被拒绝。"""
+        outside = tmp_path / "outside"
+        outside.mkdir()
+
+        def fetch(repo_path, ref, dest_dir, **kwargs):
+            os.makedirs(dest_dir)
+            os.symlink(outside, os.path.join(dest_dir, "docs"))
+            return dest_dir
+
+        mock_backend.return_value.fetch.side_effect = fetch
+        with pytest.raises(ValueError, match="Invalid subdirectory"):
+            with _fetched_source(
+                "snapshot", "https://github.com/owner/repo", "owner/repo", None,
+                "docs", None, None, 10, FetchTiming()
+            ):
+                pass
+
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_analyze_repo_fetch_metadata(self, mock_ingest):
+        """测试抓取统计写入 metadata。"""
+        mock_ingest.return_value = ("Summary", "tree", "content")
+
+        result = analyze_repo("https://github.com/owner/repo")
+
+        assert result["metadata"]["fetch"]["attempts"] == 1
+        assert result["metadata"]["fetch"]["throttled"] == 0
+        assert result["metadata"]["fetch"]["wait_seconds"] >= 0
+
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_analyze_repo_memory_metadata(self, mock_ingest):
+        """测试 metadata 中报告内存信息，预算在返回前全部释放。"""
+        from server.memory_governor import get_memory_governor
+
+        mock_ingest.return_value = ("Summary", "tree", "x" * 10000)
+
+        result = analyze_repo("https://github.com/owner/repo")
+
+        assert result["content"] == "x" * 10000
+        assert result["summary"]["estimated_tokens"] == 10000 // 3
+        assert result["metadata"]["memory"]["content_bytes"] >= 10000
+        assert result["metadata"]["memory"]["peak_rss_bytes"] > 0
+        assert mock_ingest.call_args.kwargs["max_file_size"] > 0
+        assert get_memory_governor().in_flight == 0
+
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_analyze_repo_fallback_reports_returned_content(self, mock_ingest):
+        """测试降级后只报告实际返回的内容。"""
+        mock_ingest.side_effect = [
+            ("Summary", "tree", "x" * 10000),
+            ("Summary", "tree", "# README"),
+        ]
+
+        result = analyze_repo("https://github.com/owner/repo", max_tokens=100)
+
+        assert result["metadata"]["was_fallback"] is True
+        assert result["content"] == "# README"
+        assert result["metadata"]["memory"]["content_bytes"] < 10000
+
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_analyze_repo_cache_hit(self, mock_ingest, tmp_path, monkeypatch):
+        """测试按提交缓存：命中时跳过抓取，新提交重新抓取，并按 token 区分缓存条目。"""
+        from server.blob_store import get_ingest_cache
+
+        monkeypatch.setenv("INGEST_CACHE_DIR", str(tmp_path))
+        monkeypatch.delenv("GITHUB_TOKEN", raising=False)
+        commits = ["c1"]
+        monkeypatch.setattr(
+            "server.gitingest_wrapper.resolve_commit_sha", lambda *a, **k: commits[-1]
+        )
+        content = "=" * 48 + "\nFILE: README.md\n" + "=" * 48 + "\n# Repo\n\n"
+        mock_ingest.return_value = ("Summary", "tree", content)
+
+        first = analyze_repo("https://github.com/owner/repo")
+        second = analyze_repo("https://github.com/owner/repo")
+
+        assert mock_ingest.call_count == 1
+        assert first["metadata"]["cache"] == {"enabled": True, "hit": False, "commit": "c1"}
+        assert second["metadata"]["cache"] == {"enabled": True, "hit": True, "commit": "c1"}
+        assert second["metadata"]["fetch_mode"] == "cache"
+        assert second["content"] == content
+        assert second["summary"]["description"] == "Summary"
+
+        # 分支前进到新提交：重新抓取，两个提交的 manifest 共享相同的 blob
+        commits.append("c2")
+        third = analyze_repo("https://github.com/owner/repo")
+        assert third["metadata"]["cache"]["hit"] is False
+        assert mock_ingest.call_count == 2
+        # 按解析出的提交抓取，而不是分支名
+        assert mock_ingest.call_args[0][0] == "https://github.com/owner/repo/tree/c2"
+        assert get_ingest_cache().stats()["manifests"] == 2
+        assert get_ingest_cache().stats()["blobs"] == 1
+
+        analyze_repo("https://github.com/owner/repo", github_token="secret")
+        assert mock_ingest.call_count == 3
+
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_analyze_repo_cache_skipped_without_commit(self, mock_ingest, tmp_path, monkeypatch):
+        """测试无法解析提交时不使用缓存。"""
+        monkeypatch.setenv("INGEST_CACHE_DIR", str(tmp_path))
+
+        def fail(*args, **kwargs):
+            raise OSError("API unavailable")
+
+        monkeypatch.setattr("server.gitingest_wrapper.resolve_commit_sha", fail)
+        mock_ingest.return_value = ("Summary", "tree", "content")
+
+        analyze_repo("https://github.com/owner/repo")
+        result = analyze_repo("https://github.com/owner/repo")
+
+        assert mock_ingest.call_count == 2
+        assert result["metadata"]["cache"] == {"enabled": False, "hit": False, "commit": None}
+
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_analyze_repo_compact_avoids_fallback(self, mock_ingest):
+        """测试压缩在检查 token 预算之前进行，并报告节省的 token。"""
+        sep = "=" * 48
+        body = "vendored helper code\n" * 50
+        content = "\n".join(
+            f"{sep}\nFILE: vendor{i}/helper.py\n{sep}\n{body}\n\n" for i in range(10)
+        )
+        mock_ingest.return_value = ("Summary", "tree", content)
+
+        plain = analyze_repo("https://github.com/owner/repo", max_tokens=1000)
+        compact = analyze_repo("https://github.com/owner/repo", max_tokens=1000, compact=True)
+
+        assert plain["metadata"]["was_fallback"] is True
+        assert plain["metadata"]["compaction"] is None
+        assert compact["metadata"]["was_fallback"] is False
+        assert compact["content"].count("[duplicate of vendor0/helper.py]") == 9
+        stats = compact["metadata"]["compaction"]
+        assert stats["duplicates"] == 9
+        assert stats["tokens_saved"] == (stats["chars_before"] - stats["chars_after"]) // 3
+        assert stats["tokens_saved"] > 0
+
+
+def _fake_result(url, max_tokens):
+    return {
+        "summary": {"repo_name": url, "description": "", "estimated_tokens": 10},
+        "content": "content",
+        "metadata": {"token_budget": max_tokens},
+    }
+
+
+class TestAnalyzeRepos:
+    """测试多仓库并发分析。"""
+
+    def test_split_token_budget(self):
+        """按策略分配 token 预算。"""
+        specs = [{"url": "a", "priority": 3}, {"url": "b"}]
+        assert split_token_budget(specs, 400, "priority") == [300, 100]
+        assert split_token_budget(specs, 400, "equal") == [200, 200]
+        with pytest.raises(ValueError, match="Unknown budget strategy"):
+            split_token_budget(specs, 400, "random")
+        with pytest.raises(ValueError, match="priority must be positive"):
+            split_token_budget([{"url": "a", "priority": 0}], 400)
+
+    @patch("server.gitingest_wrapper.get_repo_size_kb")
+    def test_size_budget_lookups_bounded_by_deadline(self, mock_size):
+        """按大小分配预算时，API 查询带上整体截止时间。"""
+        import time
+
+        deadlines = []
+
+        def lookup(repo_path, token, timing):
+            deadlines.append(timing.deadline)
+            return 100
+
+        mock_size.side_effect = lookup
+        deadline = time.monotonic() + 5
+        specs = [{"url": "https://github.com/o/a"}, {"url": "https://github.com/o/b"}]
+
+        assert split_token_budget(specs, 400, "size", deadline=deadline) == [200, 200]
+        assert deadlines == [deadline, deadline]
+
+    @patch("server.gitingest_wrapper.get_fetch_governor")
+    @patch("server.gitingest_wrapper.ingest_async")
+    def test_memory_wait_bounded_by_timeout(self, mock_ingest, mock_governor):
+        """内存预算被占满时，等待不超过请求的超时时间。"""
+        import time
+
+        from server.memory_governor import MemoryGovernor
+
+        memory = MemoryGovernor(budget_bytes=100)
+        with memory.reserve(100), patch(
+            "server.gitingest_wrapper.get_memory_governor", return_value=memory
+        ):
+            start = time.monotonic()
+            with pytest.raises(RuntimeError, match="Memory budget exhausted"):
+                analyze_repo("https://github.com/owner/repo", timeout=0.3)
+            assert time.monotonic() - start < 1
+
+        mock_ingest.assert_not_called()
+
+    @patch("server.gitingest_wrapper.analyze_repo")
+    def test_results_stream_in_completion_order(self, mock_analyze):
+        """先完成的仓库先返回，慢仓库不阻塞其他仓库。"""
+        release = threading.Event()
+
+        def fake(url, **kwargs):
+            if "slow" in url:
+                release.wait(5)
+            return _fake_result(url, kwargs["max_tokens"])
+
+        mock_analyze.side_effect = fake
+        repos = [
+            {"url": "https://github.com/o/slow", "priority": 1},
+            {"url": "https://github.com/o/fast", "priority": 3, "subdirectory": "docs"},
+        ]
+
+        stream = iter_analyze_repos(repos, total_tokens=4000, include_patterns="*.md")
+        first = next(stream)
+        assert first["url"] == "https://github.com/o/fast"
+        assert first["status"] == "ok"
+        assert first["token_budget"] == 3000
+        release.set()
+        second = next(stream)
+        assert second["url"] == "https://github.com/o/slow"
+        assert second["result"]["metadata"]["token_budget"] == 1000
+
+        fast_call = [c for c in mock_analyze.call_args_list if "fast" in c.args[0]][0]
+        assert fast_call.kwargs["subdirectory"] == "docs"
+        assert fast_call.kwargs["include_patterns"] == "*.md"
+
+    @patch("server.gitingest_wrapper.analyze_repo")
+    def test_errors_and_timeouts_isolated(self, mock_analyze):
+        """单个仓库失败或超时不影响其他仓库。"""
+        release = threading.Event()
+
+        def fake(url, **kwargs):
+            if "broken" in url:
+                raise RuntimeError("Repository not found")
+            if "slow" in url:
+                release.wait(5)
+            return _fake_result(url, kwargs["max_tokens"])
+
+        mock_analyze.side_effect = fake
+        try:
+            result = analyze_repos(
+                [
+                    "https://github.com/o/ok",
+                    "https://github.com/o/broken",
+                    "https://github.com/o/slow",
+                ],
+                timeout=0.5,
+            )
+        finally:
+            release.set()
+
+        statuses = [item["status"] for item in result["results"]]
+        assert statuses == ["ok", "error", "timeout"]
+        assert "not found" in result["results"][1]["error"]
+        assert result["summary"]["succeeded"] == 1
+        assert result["summary"]["failed"] == 2
+        assert result["summary"]["estimated_tokens"] == 10
+
+    @patch("server.gitingest_wrapper.get_fetch_governor")
+    def test_timed_out_ingest_releases_worker(self, mock_governor):
+        """超时的 ingest 被取消，工作线程在截止时间附近就被释放。"""
+        import asyncio
+        import time
+
+        from server.gitingest_wrapper import _run_ingest
+
+        mock_governor.return_value.call.side_effect = lambda host, token, fn, timing: fn()
+
+        async def hang(*args, **kwargs):
+            await asyncio.sleep(3)
+
+        with patch("server.gitingest_wrapper.ingest_async", side_effect=hang):
+            start = time.monotonic()
+            with pytest.raises(RuntimeError, match="timed out"):
+                _run_ingest("https://github.com/o/slow", None, timeout=0.2)
+            assert time.monotonic() - start < 1
+
+            executor = ThreadPoolExecutor(max_workers=1)
+            with patch("server.gitingest_wrapper._get_repos_executor", return_value=executor):
+                start = time.monotonic()
+                result = analyze_repos(["https://github.com/o/slow"], timeout=0.3)
+                # 工作线程已经空闲，可以立即接受新任务
+                assert executor.submit(lambda: "free").result(timeout=0.5) == "free"
+            executor.shutdown()
+
+        assert result["results"][0]["status"] in ("timeout", "error")
+        assert time.monotonic() - start < 1.5
+
+    def test_synchronous_ingest_abandoned_at_timeout(self):
+        """ingest 同步阻塞（如读取大量文件）时也在超时后返回，有无运行中的事件循环都一样。"""
+        import asyncio
+        import time
+
+        from server.gitingest_wrapper import _run_ingest
+
+        async def blocking(*args, **kwargs):
+            time.sleep(3)
+
+        async def inside_loop():
+            _run_ingest("https://github.com/o/slow", None, timeout=0.2)
+
+        with patch("server.gitingest_wrapper.ingest_async", side_effect=blocking):
+            for run in (
+                lambda: _run_ingest("https://github.com/o/slow", None, timeout=0.2),
+                lambda: asyncio.run(inside_loop()),
+            ):
+                start = time.monotonic()
+                with pytest.raises(RuntimeError, match="timed out"):
+                    run()
+                assert time.monotonic() - start < 1
+
+    def test_empty_repos(self):
+        """空列表报错。"""
+        with pytest.raises(ValueError, match="must not be empty"):
+            analyze_repos([])
@@ -4,6 +4,7 @@ from server.mcp_handler import (
     handle_mcp_request,
     handle_tools_list,
     handle_prompts_list,
+    iter_mcp_request,
     MCPMessageType
 )
 
@@ -20,8 +21,9 @@ def test_tools_list():
     assert response["jsonrpc"] == "2.0"
     assert response["id"] == 1
     assert "result" in response
-    assert len(response["result"]["tools"]) == 1
+    assert len(response["result"]["tools"]) == 2
     assert response["result"]["tools"][0]["name"] == "analyze_repo"
+    assert response["result"]["tools"][1]["name"] == "analyze_repos"
 
 
 def test_prompts_list():
@@ -138,7 +140,16 @@ def test_tools_call_success():
     assert "content" in response["result"]
     assert len(response["result"]["content"]) == 1
     assert response["result"]["content"][0]["type"] == "text"
-    mock_analyze.assert_called_once_with(url="https://github.com/test/repo", subdirectory=None, github_token=None, default_branch=None)
+    mock_analyze.assert_called_once_with(
+        url="https://github.com/test/repo",
+        subdirectory=None,
+        github_token=None,
+        default_branch=None,
+        include_patterns=None,
+        fallback_to_readme=None,
+        fetch_mode=None,
+        compact=None
+    )
 
 
 def test_tools_call_unknown_tool():
@@ -157,3 +168,70 @@ def test_tools_call_unknown_tool():
     assert "error" in response
     assert response["error"]["code"] == -32603
     assert "Unknown tool" in response["error"]["message"]
+
+
+def _analyze_repos_request(request_id, **params):
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "method": "tools/call",
+        "params": {
+            "name": "analyze_repos",
+            "arguments": {
+                "repos": ["https://github.com/a/one", "https://github.com/b/two"],
+                "total_tokens": 1000
+            },
+            **params
+        }
+    }
+
+
+def test_tools_call_analyze_repos():
+    """测试 tools/call 端点 - analyze_repos。"""
+    with patch('server.gitingest_wrapper.analyze_repos') as mock_analyze:
+        mock_analyze.return_value = {"results": [], "summary": {}}
+
+        response = handle_mcp_request(_analyze_repos_request(9))
+
+    assert "result" in response
+    mock_analyze.assert_called_once_with(
+        repos=["https://github.com/a/one", "https://github.com/b/two"],
+        total_tokens=1000
+    )
+
+
+def test_stream_analyze_repos():
+    """测试 analyze_repos 流式返回部分结果。"""
+    items = [
+        {"index": 1, "url": "https://github.com/b/two", "token_budget": 500,
+         "status": "ok", "result": {"summary": {"estimated_tokens": 5}, "content": "two"}},
+        {"index": 0, "url": "https://github.com/a/one", "token_budget": 500,
+         "status": "error", "error": "boom"},
+    ]
+
+    with patch('server.gitingest_wrapper.iter_analyze_repos', return_value=iter(items)):
+        messages = list(iter_mcp_request(
+            _analyze_repos_request(10, _meta={"progressToken": "tok"})
+        ))
+
+    methods = [message.get("method") for message in messages]
+    assert methods == [
+        "notifications/progress", "notifications/message",
+        "notifications/progress", "notifications/message",
+        None,
+    ]
+    assert messages[0]["params"] == {
+        "progressToken": "tok", "progress": 1, "total": 2,
+        "message": "https://github.com/b/two: ok",
+    }
+    assert messages[1]["params"]["data"]["result"]["content"] == "two"
+    assert messages[-1]["id"] == 10
+    assert "'succeeded': 1" in messages[-1]["result"]["content"][0]["text"]
+
+
+def test_stream_other_requests_single_response():
+    """测试非 analyze_repos 请求只返回一条响应。"""
+    messages = list(iter_mcp_request({"jsonrpc": "2.0", "id": 11, "method": "tools/list"}))
+
+    assert len(messages) == 1
+    assert messages[0]["id"] == 11
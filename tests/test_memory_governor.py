@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from server.memory_governor import MemoryGovernor, RssSampler
+
+
+class TestMemoryGovernor:
+    """测试全局在途字节预算。"""
+
+    def test_reserve_blocks_until_release(self):
+        """预算不足时阻塞，释放后放行。"""
+        governor = MemoryGovernor(budget_bytes=100)
+        first = governor.reserve(80)
+        admitted = threading.Event()
+
+        def second():
+            with governor.reserve(50):
+                admitted.set()
+
+        thread = threading.Thread(target=second)
+        thread.start()
+        time.sleep(0.05)
+        assert not admitted.is_set()
+
+        first.release()
+        thread.join(timeout=1)
+        assert admitted.is_set()
+        assert governor.in_flight == 0
+
+    def test_oversized_request_admitted_when_idle(self):
+        """空闲时超过预算的单个请求也会放行。"""
+        governor = MemoryGovernor(budget_bytes=10)
+        with governor.reserve(1000) as reservation:
+            assert governor.in_flight == 1000
+            reservation.resize(5)
+            assert governor.in_flight == 5
+        assert governor.in_flight == 0
+
+    def test_reserve_timeout(self):
+        """等待超时抛出 RuntimeError。"""
+        governor = MemoryGovernor(budget_bytes=10)
+        with governor.reserve(10):
+            with pytest.raises(RuntimeError, match="Memory budget exhausted"):
+                governor.reserve(5, timeout=0.01)
+
+
+class TestRssSampler:
+    """测试 RSS 采样。"""
+
+    def test_reports_peak(self):
+        """峰值不小于起始值。"""
+        with RssSampler(interval=0.01) as rss:
+            buffer = bytearray(8 * 1024 * 1024)
+            time.sleep(0.05)
+            del buffer
+
+        report = rss.to_dict()
+        assert report["peak_rss_bytes"] >= rss.start_bytes > 0
+        assert report["peak_rss_delta_bytes"] >= 0